@@ -24,7 +24,7 @@ from typing import Iterable
 # ----------------------------- config ---------------------------------
 
 # Directory layout
-DIRS: list[str] = [
+DIRS: tuple[str, ...] = (
     "images",
     "images/base-os-images",
     "packages/deb/docker",
@@ -45,10 +45,10 @@ DIRS: list[str] = [
     "local-apt-repo/dists/stable/main/binary-arm64",
     "local-apt-repo/pool/main/d/docker",
     "tmp",
-]
+)
 
 # Plain empty files
-FILES: list[str] = [
+FILES: tuple[str, ...] = (
     # top-level
     "manifest.yaml",
     "Makefile",
@@ -105,10 +105,10 @@ FILES: list[str] = [
 
     # tmp
     "tmp/.keep",
-]
+)
 
 # Files that should be executable on Linux (we still create them EMPTY on Windows)
-EXECUTABLES: list[str] = [
+EXECUTABLES: tuple[str, ...] = (
     "app/bin/install.sh",
     "app/bin/uninstall.sh",
     "app/bin/preflight.sh",
@@ -121,50 +121,66 @@ EXECUTABLES: list[str] = [
     "test/smoke.sh",
     "tools/seed-apt-repo.sh",
     "tools/verify-checksums.sh",
-]
+)
 
-# -------------------------- helpers -----------------------------------
+# Every parent directory the files above need (top-level files give "")
+_ALL_PARENTS: frozenset[str] = frozenset(
+    os.path.dirname(p) for p in FILES + EXECUTABLES
+)
 
-def make_dirs(base: Path, dirs: Iterable[str]) -> int:
-    created = 0
-    for d in dirs:
-        p = (base / d).resolve()
-        p.mkdir(parents=True, exist_ok=True)
-        created += 1
-    return created
+# -------------------------- helpers -----------------------------------
 
-def touch_empty(path: Path) -> None:
-    path.parent.mkdir(parents=True, exist_ok=True)
-    # Create empty file; avoid overwriting timestamps unnecessarily
-    if not path.exists():
-        path.touch()
-    else:
-        # Ensure it's a regular file (not directory)
-        if path.is_dir():
-            raise IsADirectoryError(str(path))
-
-def make_files(base: Path, files: Iterable[str]) -> int:
+# Parent directories already ensured during this run
+_created_parents: set[str] = set()
+
+def make_dirs(base: str, dirs: Iterable[str]) -> int:
+    """Create directories; each unique leaf gets a single os.makedirs call."""
+    wanted = {os.path.normpath(d) for d in dirs if d}
+    done: set[str] = set()
+    # Longest first: creating a leaf implies all of its parents
+    for d in sorted(wanted, key=len, reverse=True):
+        if d in done:
+            continue
+        os.makedirs(os.path.join(base, d), exist_ok=True)
+        while d and d not in done:
+            done.add(d)
+            d = os.path.dirname(d)
+    # Let touch_empty skip mkdir for anything created here
+    _created_parents.add(base)
+    _created_parents.update(os.path.join(base, d) for d in done)
+    return len(wanted)
+
+def touch_empty(path: str) -> None:
+    parent = os.path.dirname(path)
+    if parent not in _created_parents:
+        os.makedirs(parent, exist_ok=True)
+        _created_parents.add(parent)
+    # Create empty file without touching timestamps of an existing one;
+    # raises IsADirectoryError by itself if the path is a directory
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    os.close(fd)
+
+def make_files(base: str, files: Iterable[str]) -> int:
     created = 0
     for f in files:
-        p = (base / f).resolve()
-        touch_empty(p)
+        touch_empty(os.path.join(base, os.path.normpath(f)))
         created += 1
     return created
 
-def make_execs(base: Path, files: Iterable[str]) -> int:
+def make_execs(base: str, files: Iterable[str]) -> int:
     """Create empty files and (best-effort) mark as executable for Linux."""
-    created = 0
-    for f in files:
-        p = (base / f).resolve()
+    paths = [os.path.join(base, os.path.normpath(f)) for f in files]
+    for p in paths:
         touch_empty(p)
+    # Single chmod pass once every stub exists
+    for p in paths:
         try:
             # On Windows this is best-effort; real +x will be effective after extraction on Linux
             os.chmod(p, 0o755)
         except Exception:
             # Ignore permission quirks on Windows
             pass
-        created += 1
-    return created
+    return len(paths)
 
 # --------------------------- main -------------------------------------
 
@@ -191,10 +207,13 @@ def main() -> int:
             return 2
 
     base.mkdir(parents=True, exist_ok=True)
+    # Resolve once; entries below are plain string joins on top of it
+    root = os.fspath(base.resolve())
 
-    n_dirs = make_dirs(base, DIRS)
-    n_execs = make_execs(base, EXECUTABLES)
-    n_files = make_files(base, FILES)
+    # Pre-create every parent once so file creation never has to mkdir
+    n_dirs = make_dirs(root, DIRS + tuple(_ALL_PARENTS))
+    n_execs = make_execs(root, EXECUTABLES)
+    n_files = make_files(root, FILES)
 
     print("✓ Scaffold created")
     print(f"  Base:   {base}")
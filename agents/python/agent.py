@@ -5,16 +5,16 @@ SIEM Agent - основной скрипт для сбора и отправки
 
 import os
 import sys
-import time
 import signal
 import logging
+import threading
 import subprocess
 from pathlib import Path
 
 # Добавляем путь к модулям
 sys.path.insert(0, str(Path(__file__).parent.parent.parent))
 
-from collector.net_sniffer import NetSnifferCollector, SnifferConfig, _make_emitter
+from collector.net_sniffer import NetSnifferCollector, SnifferConfig, _BatchEmitter
 import sender
 
 def setup_detailed_logging():
@@ -84,17 +84,19 @@ def main():
     
     log.info("Agent starting: server=%s host_id=%s api_key=%s", server_url, host_id, "***" if api_key else "None")
     
+    # События уходят пачками из фонового потока, сниффер не ждёт HTTP
+    base_emitter = _BatchEmitter(sender, server_url, api_key, False)
+    
     # Создаем emitter для отправки событий с логированием
     def logging_emitter(event: dict):
         """Emitter с детальным логированием"""
-        log.debug("Sending event: %s", event.get('event_type', 'unknown'))
-        log.debug("Event details: %s", event)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("Sending event: %s, details: %s", event.get('event_type', 'unknown'), event)
         
         try:
-            # Отправляем через стандартный emitter
-            emitter = _make_emitter(sender, server_url, api_key, False)
-            emitter(event)
-            log.info("Event sent successfully: %s", event.get('event_type', 'unknown'))
+            # Ставим в очередь на отправку
+            base_emitter(event)
+            log.info("Event queued: %s", event.get('event_type', 'unknown'))
         except Exception as e:
             log.error("Error sending event: %s", e)
             log.exception("Full error traceback:")
@@ -113,10 +115,13 @@ def main():
         log_level="DEBUG"  # Увеличиваем уровень логирования
     )
     
-    # Настройка обработчика сигналов для graceful shutdown
+    # Настройка обработчика сигналов для graceful shutdown:
+    # основной цикл спит на событии и просыпается сразу по сигналу
+    stop_event = threading.Event()
+    
     def signal_handler(signum, frame):
         log.info("Получен сигнал завершения, останавливаю агент...")
-        sys.exit(0)
+        stop_event.set()
     
     signal.signal(signal.SIGINT, signal_handler)
     signal.signal(signal.SIGTERM, signal_handler)
@@ -134,10 +139,10 @@ def main():
             log.info("   3. Run: python agent.py")
             log.info("   4. Or use: .\\run_local_agent.ps1")
             
-            # Countdown timer
-            for i in range(20, 0, -1):
-                log.info(f"Starting in {i} seconds...")
-                time.sleep(1)
+            # Одна пауза вместо посекундного отсчёта
+            log.info("Starting in 20 seconds...")
+            if stop_event.wait(20):
+                return
         
         # Initialize collector
         log.info("Initializing NetSnifferCollector...")
@@ -152,17 +157,8 @@ def main():
         log.info("Agent is running. Press Ctrl+C to stop.")
         
         # Log status every 30 seconds
-        last_status_log = time.time()
-        
-        while True:
-            current_time = time.time()
-            
-            # Log status every 30 seconds
-            if current_time - last_status_log >= 30:
-                log.info("Agent active, waiting for events...")
-                last_status_log = current_time
-            
-            time.sleep(1)
+        while not stop_event.wait(30):
+            log.info("Agent active, waiting for events...")
             
     except KeyboardInterrupt:
         log.info("Received interrupt signal, stopping agent...")
@@ -177,6 +173,7 @@ def main():
                 log.info("Collector stopped")
         except Exception as e:
             log.error("Error stopping collector: %s", e)
+        base_emitter.close()
 
 if __name__ == "__main__":
     main()
@@ -1,10 +1,18 @@
 # backend/agents/python/collector/net_sniffer.py
+import ctypes
 import logging
+import mmap
+import queue
+import select
+import socket
+import struct
+import sys
 import threading
 import time
 from dataclasses import dataclass
+from types import MappingProxyType
 from typing import Callable, Optional
-from collections import defaultdict, deque
+from collections import OrderedDict, deque
 
 LOG = logging.getLogger("NetSnifferCollector")
 
@@ -16,6 +24,117 @@ except ImportError:
     SCAPY_AVAILABLE = False
     LOG.error("Scapy is required for network sniffing. Install with: pip install scapy")
 
+# --- libpcap через pypcap (необязательно): захват и BPF на стороне C ---
+try:
+    import pcap  # type: ignore
+    PCAP_AVAILABLE = True
+except ImportError:
+    PCAP_AVAILABLE = False
+
+_BPF_FILTER = "tcp or (udp and port 53)"
+
+# значения полей событий: один объект на всё время работы
+_EV_PORTSCAN = sys.intern("net.portscan.suspected")
+_EV_DNS_QUERY = sys.intern("net.dns.query")
+_SEV_HIGH = sys.intern("high")
+_SEV_INFO = sys.intern("info")
+_PROTO_TCP = sys.intern("TCP")
+_PROTO_UDP = sys.intern("UDP")
+
+# --- сырой захват через AF_PACKET (Linux): фильтр в ядре, разбор через struct ---
+_RAW_CAPTURE_AVAILABLE = hasattr(socket, "AF_PACKET")
+_ETH_P_ALL = 0x0003
+_SO_ATTACH_FILTER = 26
+_IPPROTO_TCP = 6
+
+# classic BPF для "ip and (tcp or (udp and port 53))" (аналог tcpdump -dd):
+# (code, jt, jf, k)
+_BPF_PROGRAM = (
+    (0x28, 0, 0, 0x0000000c),   # ldh [12]            ethertype
+    (0x15, 0, 11, 0x00000800),  # jeq #IPv4
+    (0x30, 0, 0, 0x00000017),   # ldb [23]            ip proto
+    (0x15, 8, 0, 0x00000006),   # jeq #TCP   -> accept
+    (0x15, 0, 8, 0x00000011),   # jeq #UDP
+    (0x28, 0, 0, 0x00000014),   # ldh [20]
+    (0x45, 6, 0, 0x00001fff),   # jset #0x1fff        не первый фрагмент -> drop
+    (0xb1, 0, 0, 0x0000000e),   # ldxb 4*([14]&0xf)
+    (0x48, 0, 0, 0x0000000e),   # ldh [x+14]          sport
+    (0x15, 2, 0, 0x00000035),   # jeq #53    -> accept
+    (0x48, 0, 0, 0x00000010),   # ldh [x+16]          dport
+    (0x15, 0, 1, 0x00000035),   # jeq #53
+    (0x06, 0, 0, 0x00040000),   # ret #262144         accept
+    (0x06, 0, 0, 0x00000000),   # ret #0              drop
+)
+
+_TCP_HDR = struct.Struct("!HHIIH")  # sport, dport, seq, ack, offset+flags
+
+def _open_raw_socket(interface: Optional[str]) -> socket.socket:
+    """AF_PACKET-сокет с прикреплённым BPF, чтобы в Python приходили только нужные кадры"""
+    sock = socket.socket(socket.AF_PACKET, socket.SOCK_RAW, socket.htons(_ETH_P_ALL))
+    try:
+        insns = b"".join(struct.pack("HBBI", *ins) for ins in _BPF_PROGRAM)
+        prog = ctypes.create_string_buffer(insns)
+        fprog = struct.pack("HP", len(_BPF_PROGRAM), ctypes.addressof(prog))
+        sock.setsockopt(socket.SOL_SOCKET, _SO_ATTACH_FILTER, fprog)
+        if interface:
+            sock.bind((interface, 0))
+    except Exception:
+        sock.close()
+        raise
+    return sock
+
+# PACKET_MMAP / TPACKET_V3: кольцо из блоков по 64 KiB (linux/if_packet.h)
+_SOL_PACKET = 263
+_PACKET_RX_RING = 5
+_PACKET_VERSION = 10
+_TPACKET_V3 = 2
+_TP_STATUS_KERNEL = 0
+_TP_STATUS_USER = 1
+_RING_BLOCK_SIZE = 1 << 16
+_RING_BLOCK_NR = 64
+_RING_FRAME_SIZE = 1 << 11
+_RING_RETIRE_TOV_MS = 100  # ядро отдаёт неполный блок не позже чем через это время
+
+_U32 = struct.Struct("I")
+# tpacket_block_desc.hdr: block_status, num_pkts, offset_to_first_pkt
+_TP3_BLOCK_HDR = struct.Struct("III")
+# tpacket3_hdr: tp_next_offset, (tp_sec, tp_nsec), tp_snaplen, tp_len, (tp_status), tp_mac
+_TP3_PKT_HDR = struct.Struct("I8xII4xH")
+
+def _open_rx_ring(sock: socket.socket) -> mmap.mmap:
+    """Включает TPACKET_V3 на сокете и отображает RX-кольцо в память"""
+    sock.setsockopt(_SOL_PACKET, _PACKET_VERSION, _TPACKET_V3)
+    req = struct.pack(
+        "7I",
+        _RING_BLOCK_SIZE, _RING_BLOCK_NR,
+        _RING_FRAME_SIZE, _RING_BLOCK_SIZE * _RING_BLOCK_NR // _RING_FRAME_SIZE,
+        _RING_RETIRE_TOV_MS, 0, 0,
+    )
+    sock.setsockopt(_SOL_PACKET, _PACKET_RX_RING, req)
+    return mmap.mmap(sock.fileno(), _RING_BLOCK_SIZE * _RING_BLOCK_NR,
+                     mmap.MAP_SHARED, mmap.PROT_READ | mmap.PROT_WRITE)
+
+def _open_pcap(interface: Optional[str]):
+    """pcap-хэндл с короткими таймаутами, чтобы dispatch() возвращался к проверке stop()"""
+    pc = pcap.pcap(name=interface, snaplen=65535, promisc=False,
+                   timeout_ms=200, immediate=True)
+    if pc.datalink() != pcap.DLT_EN10MB:
+        raise OSError("unsupported datalink type %d" % pc.datalink())
+    pc.setfilter(_BPF_FILTER)
+    return pc
+
+def _parse_ipv4_frame(frame):
+    """
+    Ethernet + IPv4 заголовок -> (proto, src, dst, смещение L4) или None.
+    """
+    if len(frame) < 34 or frame[12] != 0x08 or frame[13] != 0x00:
+        return None
+    l4 = 14 + (frame[14] & 0x0f) * 4
+    return (frame[23],
+            socket.inet_ntoa(frame[26:30]),
+            socket.inet_ntoa(frame[30:34]),
+            l4)
+
 @dataclass
 class SnifferConfig:
     server_url: str
@@ -38,41 +157,157 @@ def _make_emitter(sender_module, server_url: str, token: Optional[str], verify_t
             LOG.error("Emitter failed: %s", e)
     return emitter
 
+class _BatchEmitter:
+    """
+    Emitter с очередью: поток захвата только кладёт событие в очередь,
+    фоновый поток отправляет их пачками через sender.send_batch
+    (или по одному, пока сервер не поддерживает batch-эндпоинт).
+    """
+
+    # Через сколько секунд снова пробовать batch-эндпоинт после отказа сервера
+    BATCH_RETRY_SEC = 300.0
+
+    def __init__(self, sender_module, server_url: str, token: Optional[str], verify_tls: bool,
+                 max_batch: int = 128, maxsize: int = 10_000):
+        self._sender = sender_module
+        self._server_url = server_url
+        self._token = token
+        self._verify_tls = verify_tls
+        self._max_batch = max_batch
+        self._q = queue.Queue(maxsize)
+        self._batch_retry_at = 0.0  # до этого момента (monotonic) события идут по одному
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def __call__(self, event: dict):
+        try:
+            self._q.put_nowait(event)
+        except queue.Full:
+            LOG.warning("Emitter queue is full, dropping event %s", event.get("event_type"))
+
+    def close(self, timeout: float = 5.0):
+        """Отправляет то, что осталось в очереди, и останавливает поток"""
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        q = self._q
+        while not (self._stop.is_set() and q.empty()):
+            try:
+                batch = [q.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+            while len(batch) < self._max_batch:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            self._flush(batch)
+
+    def _flush(self, batch: list):
+        try:
+            if time.monotonic() >= self._batch_retry_at:
+                resp = self._sender.send_batch(self._server_url, self._token, batch,
+                                               verify_tls=self._verify_tls)
+                # Ошибки обработчика (в т.ч. 404 "агент не найден") — не повод отказываться от пачек
+                if resp is None or not self._sender.endpoint_missing(resp):
+                    return
+                LOG.warning("Server has no batch ingest (HTTP %s), sending events one by one for %.0f sec",
+                            resp.status_code, self.BATCH_RETRY_SEC)
+                self._batch_retry_at = time.monotonic() + self.BATCH_RETRY_SEC
+            for event in batch:
+                self._sender.send_event(self._server_url, self._token, event,
+                                        verify_tls=self._verify_tls)
+        except Exception as e:
+            LOG.error("Emitter failed: %s", e)
+
+def _parse_dns_question(buf, off: int):
+    """
+    QNAME/QTYPE первого вопроса DNS-сообщения, начинающегося с buf[off]:
+    метки с префиксом длины идут сразу после 12-байтового заголовка.
+    """
+    if not (buf[off + 4] or buf[off + 5]):  # QDCOUNT == 0
+        raise ValueError("DNS message without question")
+    pos = off + 12
+    labels = []
+    n = buf[pos]
+    while n:
+        if n & 0xc0:
+            raise ValueError("compressed label in DNS question")
+        labels.append(bytes(buf[pos + 1:pos + 1 + n]))
+        pos += 1 + n
+        n = buf[pos]
+    if pos + 3 > len(buf):
+        raise ValueError("truncated DNS question")
+    return (b".".join(labels).decode("utf-8", "ignore"),
+            (buf[pos + 1] << 8) | buf[pos + 2])
+
 # --- простой детектор портскана (N уникальных портов за окно T) ---
 class _PortscanDetector:
+    # сколько источников держим одновременно; самые давно виденные вытесняются
+    MAX_SOURCES = 10000
+
     def __init__(self, threshold: int, window_sec: int):
         self.threshold = int(threshold)
         self.window = int(window_sec)
-        self._by_src = defaultdict(lambda: deque(maxlen=10000))  # src_ip -> deque[(ts, dport)]
+        # src_ip -> (deque[(ts, dport)], {dport: сколько раз в окне}), порядок = LRU
+        self._by_src: "OrderedDict[str, tuple[deque, dict]]" = OrderedDict()
 
     def feed(self, ts: float, src_ip: str, dport: int):
-        dq = self._by_src[src_ip]
-        dq.append((ts, int(dport)))
+        by_src = self._by_src
+        try:
+            dq, counts = by_src[src_ip]
+            by_src.move_to_end(src_ip)
+        except KeyError:
+            dq, counts = by_src[src_ip] = (deque(maxlen=10000), {})
+            if len(by_src) > self.MAX_SOURCES:
+                by_src.popitem(last=False)
+        dport = int(dport)
+        if len(dq) == dq.maxlen:
+            # deque сам вытолкнет старейший элемент — учитываем его заранее
+            self._forget(counts, dq.popleft()[1])
+        dq.append((ts, dport))
+        counts[dport] = counts.get(dport, 0) + 1
         # очистка старых значений за окно
         while dq and (ts - dq[0][0]) > self.window:
-            dq.popleft()
-        uniq_ports = {p for _, p in dq}
-        return (len(uniq_ports) >= self.threshold,
+            self._forget(counts, dq.popleft()[1])
+        unique = len(counts)
+        if unique < self.threshold:
+            # подавляющее большинство пакетов: выборку портов не строим
+            return False, None
+        return (True,
                 {"src_ip": src_ip,
-                 "unique_ports": len(uniq_ports),
-                 "sample_ports": sorted(list(uniq_ports))[:20]})
+                 "unique_ports": unique,
+                 "sample_ports": sorted(counts)[:20]})
+
+    @staticmethod
+    def _forget(counts: dict, port: int):
+        c = counts[port] - 1
+        if c:
+            counts[port] = c
+        else:
+            del counts[port]
+
+# порядок вывода флагов совпадает с прежней веткой if-ов
+_TCP_FLAG_BITS = (
+    (0x02, "SYN"), (0x10, "ACK"), (0x01, "FIN"), (0x04, "RST"),
+    (0x08, "PSH"), (0x20, "URG"), (0x40, "ECE"), (0x80, "CWR"),
+)
+# все 256 комбинаций считаются один раз при импорте
+_FLAG_TABLE = tuple(
+    sys.intern("|".join(name for bit, name in _TCP_FLAG_BITS if i & bit))
+    for i in range(256)
+)
 
 def _flags_to_text(flags: int) -> str:
-    bits = []
-    if flags & 0x02: bits.append("SYN")
-    if flags & 0x10: bits.append("ACK")
-    if flags & 0x01: bits.append("FIN")
-    if flags & 0x04: bits.append("RST")
-    if flags & 0x08: bits.append("PSH")
-    if flags & 0x20: bits.append("URG")
-    if flags & 0x40: bits.append("ECE")
-    if flags & 0x80: bits.append("CWR")
-    return "|".join(bits)
+    return _FLAG_TABLE[flags & 0xff]
 
 class NetSnifferCollector:
     """
     Реальный сетевой коллектор:
-      - слушает интерфейс через scapy.sniff()
+      - слушает интерфейс через AF_PACKET-сокет с BPF в ядре (Linux),
+        через libpcap (pypcap, если установлен), иначе через scapy.sniff()
       - генерирует события:
           * net.portscan.suspected (TCP SYN без ACK; N уникальных портов за окно)
           * net.dns.query (UDP+DNS, qr=0)
@@ -84,6 +319,9 @@ class NetSnifferCollector:
             
         self.config = config
         self.emitter = emitter
+        # постоянная часть details — чтобы можно было связать на стороне аналитики
+        self._details_base = MappingProxyType(
+            {"host_id": config.host_id, "iface": config.interface or ""})
         self._stop = threading.Event()
         self._thread = threading.Thread(target=self._run, daemon=True)
 
@@ -175,14 +413,14 @@ class NetSnifferCollector:
             if v is not None:
                 ev[k] = v
 
-        # детали (словарь) — сервер сохранит как JSON в поле details
-        details = fields.get("details") or {}
-        # чтобы можно было связать на стороне аналитики:
-        details.setdefault("host_id", self.config.host_id)
-        details.setdefault("iface", self.config.interface or "")
+        # детали (словарь) — сервер сохранит как JSON в поле details;
+        # ключи события перекрывают host_id/iface, как раньше setdefault
+        details = fields.get("details")
+        details = {**self._details_base, **details} if details else dict(self._details_base)
         ev["details"] = details
 
-        LOG.debug("emit %s: %s", etype, {k: ev[k] for k in ev.keys() if k != "details"} | {"details.keys": list(details.keys())})
+        if LOG.isEnabledFor(logging.DEBUG):
+            LOG.debug("emit %s: %s", etype, {k: ev[k] for k in ev.keys() if k != "details"} | {"details.keys": list(details.keys())})
         self.emitter(ev)
 
     def _sniffer_loop(self):
@@ -193,81 +431,97 @@ class NetSnifferCollector:
         detector = _PortscanDetector(self.config.portscan_threshold, self.config.portscan_window_sec)
         packet_count = 0
         event_count = 0
+        # уровень проверяется раз в итерацию цикла, а не на каждый пакет
+        debug = LOG.isEnabledFor(logging.DEBUG)
+        feed = detector.feed
+        now = time.time
         
         LOG.info("Starting packet capture loop...")
-        LOG.info("BPF filter: %s", "tcp or (udp and port 53)")
+        LOG.info("BPF filter: %s", _BPF_FILTER)
         LOG.info("Interface: %s", self.config.interface or "auto-detect")
 
+        def on_tcp(src, dst, size, sport, dport, flags):
+            nonlocal event_count
+            if debug:
+                LOG.debug("🔗 TCP пакет: %s:%d → %s:%d, флаги: %s", 
+                         src, sport, dst, dport, _flags_to_text(flags))
+            
+            # SYN без ACK
+            if (flags & 0x02) and not (flags & 0x10):
+                if debug:
+                    LOG.debug("Detected SYN without ACK - checking for port scan")
+                trig, info = feed(now(), src, dport)
+                if trig:
+                    event_count += 1
+                    LOG.warning("PORT SCAN DETECTED! %s → %s:%d (unique ports: %d)", 
+                               src, dst, dport, info["unique_ports"])
+                    
+                    self._emit_event(
+                        _EV_PORTSCAN,
+                        severity=_SEV_HIGH,
+                        src_ip=src,
+                        dst_ip=dst,
+                        dst_port=dport,
+                        protocol=_PROTO_TCP,
+                        packet_size=size,
+                        flags=_flags_to_text(flags),
+                        details={
+                            "unique_ports": info["unique_ports"],
+                            "sample_ports": info["sample_ports"],
+                            "window_sec": self.config.portscan_window_sec,
+                        },
+                    )
+
+        def on_dns(src, dst, size, qname, qtype):
+            nonlocal event_count
+            event_count += 1
+            
+            LOG.info("DNS query: %s → %s, domain: %s, type: %d", 
+                    src, dst, qname, qtype)
+            
+            self._emit_event(
+                _EV_DNS_QUERY,
+                severity=_SEV_INFO,
+                src_ip=src,
+                dst_ip=dst,
+                protocol=_PROTO_UDP,
+                packet_size=size,
+                details={"qname": qname, "qtype": qtype},
+            )
+
         def on_pkt(pkt):
-            nonlocal packet_count, event_count
+            nonlocal packet_count
             packet_count += 1
             
             try:
-                if IP not in pkt:
-                    LOG.debug("📦 Пакет без IP заголовка, пропускаем")
+                ip = pkt.getlayer(IP)
+                if ip is None:
+                    if debug:
+                        LOG.debug("📦 Пакет без IP заголовка, пропускаем")
                     return
                     
-                src = pkt[IP].src
-                dst = pkt[IP].dst
+                src = ip.src
+                dst = ip.dst
                 size = int(len(pkt))
                 
-                LOG.debug("📦 Обработка пакета #%d: %s → %s (размер: %d байт)", 
-                         packet_count, src, dst, size)
+                if debug:
+                    LOG.debug("📦 Обработка пакета #%d: %s → %s (размер: %d байт)", 
+                             packet_count, src, dst, size)
 
                 # TCP: портскан по SYN без ACK
-                if TCP in pkt:
-                    flags = int(pkt[TCP].flags)
-                    dport = int(pkt[TCP].dport)
-                    sport = int(pkt[TCP].sport)
-                    
-                    LOG.debug("🔗 TCP пакет: %s:%d → %s:%d, флаги: %s", 
-                             src, sport, dst, dport, _flags_to_text(flags))
-                    
-                    # SYN без ACK
-                    if (flags & 0x02) and not (flags & 0x10):
-                        LOG.debug("Detected SYN without ACK - checking for port scan")
-                        trig, info = detector.feed(time.time(), src, dport)
-                        if trig:
-                            event_count += 1
-                            LOG.warning("PORT SCAN DETECTED! %s → %s:%d (unique ports: %d)", 
-                                       src, dst, dport, info["unique_ports"])
-                            
-                            self._emit_event(
-                                "net.portscan.suspected",
-                                severity="high",
-                                src_ip=src,
-                                dst_ip=dst,
-                                dst_port=dport,
-                                protocol="TCP",
-                                packet_size=size,
-                                flags=_flags_to_text(flags),
-                                details={
-                                    "unique_ports": info["unique_ports"],
-                                    "sample_ports": info["sample_ports"],
-                                    "window_sec": self.config.portscan_window_sec,
-                                },
-                            )
+                tcp = ip.getlayer(TCP)
+                if tcp is not None:
+                    on_tcp(src, dst, size, int(tcp.sport), int(tcp.dport), int(tcp.flags))
                     return  # на TCP больше ничего не шлём, чтобы не заспамить
 
                 # DNS-запросы (UDP + DNS, только запросы)
-                if UDP in pkt and pkt.haslayer(DNS) and pkt[DNS].qr == 0:
+                udp = ip.getlayer(UDP)
+                dns = udp.getlayer(DNS) if udp is not None else None
+                if dns is not None and dns.qr == 0:
                     try:
-                        qname = pkt[DNSQR].qname.decode("utf-8", "ignore").rstrip(".")
-                        qtype = int(pkt[DNSQR].qtype)
-                        event_count += 1
-                        
-                        LOG.info("DNS query: %s → %s, domain: %s, type: %d", 
-                                src, dst, qname, qtype)
-                        
-                        self._emit_event(
-                            "net.dns.query",
-                            severity="info",
-                            src_ip=src,
-                            dst_ip=dst,
-                            protocol="UDP",
-                            packet_size=size,
-                            details={"qname": qname, "qtype": qtype},
-                        )
+                        q = dns.getlayer(DNSQR)
+                        qname = q.qname.decode("utf-8", "ignore").rstrip(".")
+                        on_dns(src, dst, size, qname, int(q.qtype))
                     except Exception as e:
                         LOG.error("Error processing DNS packet: %s", e)
                         
@@ -275,30 +529,154 @@ class NetSnifferCollector:
                 LOG.error("Error processing packet: %s", e)
                 LOG.exception("Full error traceback:")
 
-        # короткими итерациями, чтобы реагировать на stop()
-        bpf = "tcp or (udp and port 53)"
-        LOG.info("Sniff loop started; bpf='%s'", bpf)
-        
-        while not self._stop.is_set():
-            sniff_kwargs = dict(prn=on_pkt, store=False, timeout=2)
-            if self.config.interface:
-                sniff_kwargs["iface"] = self.config.interface
+        def on_frame(frame, size):
+            """Тот же разбор, что и on_pkt, но по сырым байтам Ethernet-кадра"""
+            nonlocal packet_count
+            packet_count += 1
+            
             try:
-                sniff(filter=bpf, **sniff_kwargs)
+                hdr = _parse_ipv4_frame(frame)
+                if hdr is None:
+                    if debug:
+                        LOG.debug("📦 Пакет без IP заголовка, пропускаем")
+                    return
+                proto, src, dst, l4 = hdr
                 
-                # Логируем статистику каждые 100 пакетов
-                if packet_count > 0 and packet_count % 100 == 0:
-                    LOG.info("Statistics: processed %d packets, created %d events", 
-                            packet_count, event_count)
-                    
+                if debug:
+                    LOG.debug("📦 Обработка пакета #%d: %s → %s (размер: %d байт)", 
+                             packet_count, src, dst, size)
+
+                if proto == _IPPROTO_TCP:
+                    sport, dport, _, _, off_flags = _TCP_HDR.unpack_from(frame, l4)
+                    on_tcp(src, dst, size, sport, dport, off_flags & 0xff)
+                    return
+
+                # UDP: фильтр ядра уже пропустил только порт 53
+                dns = l4 + 8
+                if len(frame) > dns + 12 and not frame[dns + 2] & 0x80:  # qr == 0
+                    try:
+                        qname, qtype = _parse_dns_question(frame, dns)
+                        on_dns(src, dst, size, qname, qtype)
+                    except Exception as e:
+                        LOG.error("Error processing DNS packet: %s", e)
+                        
             except Exception as e:
-                LOG.error("Sniff error: %s", e)
+                LOG.error("Error processing packet: %s", e)
                 LOG.exception("Full error traceback:")
-                break
-        
-        LOG.info("Packet capture loop stopped")
-        LOG.info("Final statistics: processed %d packets, created %d events", 
-                packet_count, event_count)
+
+        def log_stats():
+            nonlocal debug
+            debug = LOG.isEnabledFor(logging.DEBUG)
+            # Логируем статистику каждые 100 пакетов
+            if packet_count > 0 and packet_count % 100 == 0:
+                LOG.info("Statistics: processed %d packets, created %d events", 
+                        packet_count, event_count)
+
+        try:
+            if _RAW_CAPTURE_AVAILABLE:
+                try:
+                    sock = _open_raw_socket(self.config.interface)
+                except OSError as e:
+                    LOG.warning("Raw AF_PACKET capture unavailable (%s)", e)
+                else:
+                    LOG.info("Raw socket loop started; bpf='%s' (kernel filter)", _BPF_FILTER)
+                    self._raw_capture(sock, on_frame, log_stats)
+                    return
+            
+            if PCAP_AVAILABLE:
+                try:
+                    pc = _open_pcap(self.config.interface)
+                except Exception as e:
+                    LOG.warning("libpcap capture unavailable (%s)", e)
+                else:
+                    LOG.info("libpcap loop started; bpf='%s' (pcap_compile)", _BPF_FILTER)
+                    self._pcap_capture(pc, on_frame, log_stats)
+                    return
+            
+            # короткими итерациями, чтобы реагировать на stop()
+            LOG.info("Sniff loop started; bpf='%s'", _BPF_FILTER)
+            
+            while not self._stop.is_set():
+                sniff_kwargs = dict(prn=on_pkt, store=False, timeout=2)
+                if self.config.interface:
+                    sniff_kwargs["iface"] = self.config.interface
+                try:
+                    sniff(filter=_BPF_FILTER, **sniff_kwargs)
+                    log_stats()
+                except Exception as e:
+                    LOG.error("Sniff error: %s", e)
+                    LOG.exception("Full error traceback:")
+                    break
+        finally:
+            LOG.info("Packet capture loop stopped")
+            LOG.info("Final statistics: processed %d packets, created %d events", 
+                    packet_count, event_count)
+
+    def _raw_capture(self, sock, on_frame, on_idle):
+        """
+        Чтение кадров из AF_PACKET-сокета: по возможности через mmap-кольцо
+        TPACKET_V3, иначе recv_into в заранее выделенный буфер.
+        """
+        with sock:
+            try:
+                ring = _open_rx_ring(sock)
+            except OSError as e:
+                LOG.warning("PACKET_MMAP ring unavailable (%s), using recv() per packet", e)
+            else:
+                with ring:
+                    self._ring_capture(sock, ring, on_frame, on_idle)
+                return
+
+            # MSG_TRUNC возвращает реальную длину кадра, даже если он длиннее буфера
+            buf = bytearray(65536)
+            view = memoryview(buf)
+            sock.settimeout(2)
+            while not self._stop.is_set():
+                try:
+                    size = sock.recv_into(buf, len(buf), socket.MSG_TRUNC)
+                except socket.timeout:
+                    on_idle()
+                    continue
+                on_frame(view[:min(size, len(buf))], size)
+
+    def _pcap_capture(self, pc, on_frame, on_idle):
+        """
+        Цикл pcap_dispatch: чтение и фильтрация идут в libpcap, в Python
+        попадают только кадры, прошедшие скомпилированный BPF.
+        """
+        def on_pcap(ts, buf):
+            on_frame(buf, len(buf))
+
+        while not self._stop.is_set():
+            if not pc.dispatch(-1, on_pcap):
+                on_idle()
+
+    def _ring_capture(self, sock, ring, on_frame, on_idle):
+        """
+        Ядро складывает кадры в блоки общего mmap-кольца; блок читается целиком
+        без системных вызовов на пакет и возвращается ядру сменой block_status.
+        """
+        poller = select.poll()
+        poller.register(sock, select.POLLIN | select.POLLERR)
+        block = 0
+        while not self._stop.is_set():
+            base = block * _RING_BLOCK_SIZE
+            status, num_pkts, first = _TP3_BLOCK_HDR.unpack_from(ring, base + 8)
+            if not status & _TP_STATUS_USER:
+                if not poller.poll(2000):
+                    on_idle()
+                continue
+
+            off = base + first
+            for _ in range(num_pkts):
+                next_off, snaplen, length, mac = _TP3_PKT_HDR.unpack_from(ring, off)
+                # on_frame не должен держать ссылку на срез после возврата
+                with memoryview(ring)[off + mac:off + mac + snaplen] as frame:
+                    on_frame(frame, length)
+                off += next_off
+
+            _U32.pack_into(ring, base + 8, _TP_STATUS_KERNEL)
+            block = (block + 1) % _RING_BLOCK_NR
 
     def _run(self):
         # Проверяем права доступа перед запуском сниффера
@@ -6,15 +6,20 @@
 
 import os
 import sys
-import time
+import gzip
 import json
+import asyncio
 import psutil
+import signal
 import socket
-import subprocess
+import sqlite3
 import logging
+from dataclasses import dataclass
+from functools import partial
 from datetime import datetime
 from typing import Dict, List, Any, Optional
-import requests
+from xml.etree import ElementTree
+import aiohttp
 
 # Настройка логирования
 logging.basicConfig(
@@ -24,98 +29,250 @@ logging.basicConfig(
 )
 log = logging.getLogger("privileged_agent")
 
+# значения полей событий: один объект на всё время работы
+_SOURCE = sys.intern("privileged_agent")
+_SEV_INFO = sys.intern("info")
+_SEV_WARNING = sys.intern("warning")
+_SEV_ERROR = sys.intern("error")
+_SEV_CRITICAL = sys.intern("critical")
+_EV_PROCESS_CREATED = sys.intern("process.created")
+_EV_CONNECTION = sys.intern("network.connection")
+_EV_CONNECTION_CLOSED = sys.intern("network.connection_closed")
+_EV_PERFORMANCE = sys.intern("system.performance")
+_EV_SECURITY = sys.intern("windows.security_event")
+_FAMILY_IPV4 = sys.intern("IPv4")
+_FAMILY_IPV6 = sys.intern("IPv6")
+
+# LevelDisplayName события Windows -> severity; всё остальное — info
+_SEV_MAP = {
+    "Warning": _SEV_WARNING,
+    "Error": _SEV_ERROR,
+    "Critical": _SEV_CRITICAL,
+}
+
+@dataclass
+class Event:
+    """Событие агента: фиксированный набор полей в слотах вместо словаря"""
+    __slots__ = ("timestamp", "source", "host_id", "event_type", "severity", "details")
+    timestamp: str
+    source: str
+    host_id: str
+    event_type: str
+    severity: str
+    details: Dict[str, Any]
+
+def _event_fields(obj: Any) -> Dict[str, Any]:
+    if isinstance(obj, Event):
+        return {name: getattr(obj, name) for name in Event.__slots__}
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+# --- orjson (необязательно): сериализация тела запроса в C, dataclass понимает сам ---
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":"), default=_event_fields).encode()
+
+# --- uvloop (необязательно, не для Windows): более быстрый цикл событий ---
+try:
+    import uvloop  # type: ignore
+    UVLOOP_AVAILABLE = True
+except ImportError:
+    UVLOOP_AVAILABLE = False
+
+# --- pywin32 (только Windows): чтение журнала без запуска PowerShell ---
+try:
+    import win32evtlog  # type: ignore
+    WIN32EVTLOG_AVAILABLE = True
+except ImportError:
+    WIN32EVTLOG_AVAILABLE = False
+
+# команда для долгоживущего PowerShell; маркер отделяет ответы друг от друга
+_PS_SENTINEL = "<<<SIEM-END>>>"
+_PS_QUERY = (
+    "Get-WinEvent -FilterHashtable @{LogName='Security'; StartTime=(Get-Date).AddMinutes(-5)} "
+    "-MaxEvents 10 -ErrorAction SilentlyContinue | ConvertTo-Json -Compress; "
+    "Write-Output '" + _PS_SENTINEL + "'"
+)
+
+_EVT_NS = "{http://schemas.microsoft.com/win/2004/08/events/event}"
+_publisher_metadata: Dict[str, Any] = {}
+
+def _read_security_events(max_events: int = 10, minutes: int = 5) -> List[Dict[str, Any]]:
+    """
+    Последние события журнала Security через EvtQuery/EvtNext — те же поля,
+    что отдаёт Get-WinEvent | ConvertTo-Json (Id, LevelDisplayName, LogName,
+    ProviderName, Message).
+    """
+    query = "*[System[TimeCreated[timediff(@SystemTime) <= %d]]]" % (minutes * 60 * 1000)
+    handle = win32evtlog.EvtQuery(
+        "Security", win32evtlog.EvtQueryChannelPath | win32evtlog.EvtQueryReverseDirection, query, None)
+    records = []
+    while len(records) < max_events:
+        batch = win32evtlog.EvtNext(handle, max_events - len(records))
+        if not batch:
+            break
+        for evt in batch:
+            system = ElementTree.fromstring(
+                win32evtlog.EvtRender(evt, win32evtlog.EvtRenderEventXml)).find(_EVT_NS + "System")
+            provider = system.find(_EVT_NS + "Provider").get("Name")
+            record = {
+                "Id": int(system.findtext(_EVT_NS + "EventID")),
+                "LevelDisplayName": None,
+                "LogName": system.findtext(_EVT_NS + "Channel"),
+                "ProviderName": provider,
+                "Message": "",
+            }
+            try:
+                meta = _publisher_metadata.get(provider)
+                if meta is None:
+                    meta = _publisher_metadata[provider] = win32evtlog.EvtOpenPublisherMetadata(provider)
+                record["LevelDisplayName"] = win32evtlog.EvtFormatMessage(
+                    meta, evt, win32evtlog.EvtFormatMessageLevel)
+                record["Message"] = win32evtlog.EvtFormatMessage(
+                    meta, evt, win32evtlog.EvtFormatMessageEvent) or ""
+            except Exception:
+                # у провайдера может не быть ресурсов сообщений
+                pass
+            records.append(record)
+    return records
+
+def _proc_attr(getter):
+    """Значение поля процесса или None, если к нему нет доступа"""
+    try:
+        return getter()
+    except psutil.AccessDenied:
+        return None
+
 class PrivilegedWindowsCollector:
     """Сборщик данных Windows с привилегированным доступом"""
     
-    def __init__(self, server_url: str, api_key: str):
+    # сколько неотправленных пакетов хранить на диске и дозакачивать за цикл
+    SPOOL_MAX_BATCHES = 1000
+    SPOOL_DRAIN_BATCHES = 10
+    # событий в одном POST; порции одного цикла уходят параллельно
+    SEND_CHUNK = 500
+    SEND_ATTEMPTS = 3
+    RETRY_AFTER_MAX = 10.0
+
+    def __init__(self, server_url: str, api_key: str, spool_path: str = "agent_queue.db"):
         self.server_url = server_url
         self.api_key = api_key
-        self.host_id = socket.gethostname()
+        self.host_id = sys.intern(socket.gethostname())
+        # PID, уже известные агенту: процессы, живущие до старта, не считаются новыми
+        self._known_pids = set(psutil.pids())
+        # соединения, о которых уже сообщили: (laddr, raddr, pid) -> details.connection
+        self._known_conns: Dict[tuple, Dict[str, Any]] = {}
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._pwsh: Optional[asyncio.subprocess.Process] = None
+        # очередь пакетов, не принятых сервером: переживает рестарт агента
+        self._spool = sqlite3.connect(spool_path, isolation_level=None)
+        self._spool.execute("PRAGMA journal_mode=WAL")
+        self._spool.execute("PRAGMA synchronous=NORMAL")
+        self._spool.execute("CREATE TABLE IF NOT EXISTS q(id INTEGER PRIMARY KEY, blob BLOB)")
+        # первый вызов только запоминает счётчики CPU для следующего замера
+        psutil.cpu_percent(interval=None)
         
-    def collect_system_events(self) -> List[Dict[str, Any]]:
+    def _event_template(self) -> Any:
+        """Event с общими для цикла полями: дальше нужны только event_type, severity, details"""
+        return partial(Event, datetime.utcnow().isoformat() + "Z", _SOURCE, self.host_id)
+
+    def collect_system_events(self) -> List[Event]:
         """Сбор системных событий Windows"""
         events = []
+        # одна метка времени на весь цикл сбора
+        make = self._event_template()
         
         try:
-            # Мониторинг процессов
-            for proc in psutil.process_iter(['pid', 'name', 'username', 'cmdline', 'create_time']):
+            # Мониторинг процессов: событие только для PID, которых не было
+            # в прошлом цикле; oneshot() кэширует данные процесса на время блока
+            current = set(psutil.pids())
+            new_pids = current - self._known_pids
+            self._known_pids = current
+            # глобальные имена и атрибуты — в локальные: цикл идёт по каждому новому PID
+            Process = psutil.Process
+            fromtimestamp = datetime.fromtimestamp
+            append = events.append
+            for pid in new_pids:
                 try:
-                    proc_info = proc.info
-                    if proc_info['create_time'] and (time.time() - proc_info['create_time'] < 60):  # Новые процессы за последнюю минуту
-                        event = {
-                            "timestamp": datetime.utcnow().isoformat() + "Z",
-                            "event_type": "process.created",
-                            "source": "privileged_agent",
-                            "host_id": self.host_id,
-                            "severity": "info",
-                            "details": {
-                                "process": {
-                                    "pid": proc_info['pid'],
-                                    "name": proc_info['name'],
-                                    "username": proc_info.get('username', 'unknown'),
-                                    "command_line": ' '.join(proc_info.get('cmdline', [])) if proc_info.get('cmdline') else '',
-                                    "created_at": datetime.fromtimestamp(proc_info['create_time']).isoformat()
-                                }
+                    proc = Process(pid)
+                    with proc.oneshot():
+                        create_time = proc.create_time()
+                        # недоступные поля — None, как раньше у process_iter(attrs)
+                        cmdline = _proc_attr(proc.cmdline)
+                        append(make(_EV_PROCESS_CREATED, _SEV_INFO, {
+                            "process": {
+                                "pid": pid,
+                                "name": _proc_attr(proc.name),
+                                "username": _proc_attr(proc.username),
+                                "command_line": ' '.join(cmdline) if cmdline else '',
+                                "created_at": fromtimestamp(create_time).isoformat()
                             }
-                        }
-                        events.append(event)
+                        }))
                 except (psutil.NoSuchProcess, psutil.AccessDenied):
                     continue
                     
         except Exception as e:
-            log.error(f"Ошибка сбора процессов: {e}")
+            log.error("Ошибка сбора процессов: %s", e)
             
         return events
     
-    def collect_network_connections(self) -> List[Dict[str, Any]]:
-        """Сбор сетевых соединений"""
+    def collect_network_connections(self) -> List[Event]:
+        """
+        Сбор сетевых соединений: только изменения с прошлого цикла —
+        новые ESTABLISHED (network.connection) и исчезнувшие (network.connection_closed).
+        """
         events = []
+        make = self._event_template()
         
         try:
-            connections = psutil.net_connections(kind='inet')
-            for conn in connections:
-                if conn.status == psutil.CONN_ESTABLISHED:
-                    event = {
-                        "timestamp": datetime.utcnow().isoformat() + "Z",
-                        "event_type": "network.connection",
-                        "source": "privileged_agent", 
-                        "host_id": self.host_id,
-                        "severity": "info",
-                        "details": {
-                            "connection": {
-                                "local_addr": f"{conn.laddr.ip}:{conn.laddr.port}" if conn.laddr else "unknown",
-                                "remote_addr": f"{conn.raddr.ip}:{conn.raddr.port}" if conn.raddr else "unknown",
-                                "status": conn.status,
-                                "pid": conn.pid,
-                                "family": "IPv4" if conn.family == socket.AF_INET else "IPv6"
-                            }
-                        }
+            # ESTABLISHED бывает только у TCP — UDP-сокеты не запрашиваем вовсе
+            established = psutil.CONN_ESTABLISHED
+            known = self._known_conns
+            current = {}
+            for _fd, family, _type, laddr, raddr, status, pid in psutil.net_connections(kind='tcp'):
+                if status != established:
+                    continue
+                key = (laddr, raddr, pid)
+                connection = known.get(key)
+                if connection is None:
+                    connection = {
+                        "local_addr": f"{laddr[0]}:{laddr[1]}" if laddr else "unknown",
+                        "remote_addr": f"{raddr[0]}:{raddr[1]}" if raddr else "unknown",
+                        "status": status,
+                        "pid": pid,
+                        "family": _FAMILY_IPV4 if family == socket.AF_INET else _FAMILY_IPV6
                     }
-                    events.append(event)
+                    events.append(make(_EV_CONNECTION, _SEV_INFO, {"connection": connection}))
+                current[key] = connection
+            
+            for key in known.keys() - current.keys():
+                events.append(make(_EV_CONNECTION_CLOSED, _SEV_INFO,
+                                   {"connection": dict(known[key], status="CLOSED")}))
+            self._known_conns = current
                     
         except Exception as e:
-            log.error(f"Ошибка сбора сетевых соединений: {e}")
+            log.error("Ошибка сбора сетевых соединений: %s", e)
             
         return events
     
-    def collect_system_performance(self) -> List[Dict[str, Any]]:
+    def collect_system_performance(self) -> List[Event]:
         """Сбор данных производительности системы"""
         events = []
+        make = self._event_template()
         
         try:
-            # CPU usage
-            cpu_percent = psutil.cpu_percent(interval=1)
+            # CPU usage: среднее с прошлого вызова (т.е. за прошлый цикл), без ожидания
+            cpu_percent = psutil.cpu_percent(interval=None)
             memory = psutil.virtual_memory()
             disk_io = psutil.disk_io_counters()
             net_io = psutil.net_io_counters()
             
-            event = {
-                "timestamp": datetime.utcnow().isoformat() + "Z",
-                "event_type": "system.performance",
-                "source": "privileged_agent",
-                "host_id": self.host_id,
-                "severity": "info",
-                "details": {
+            event = make(
+                _EV_PERFORMANCE,
+                _SEV_INFO,
+                {
                     "performance": {
                         "cpu_percent": cpu_percent,
                         "memory_percent": memory.percent,
@@ -126,94 +283,201 @@ class PrivilegedWindowsCollector:
                         "network_recv_mb": round(net_io.bytes_recv / (1024**2), 2) if net_io else 0
                     }
                 }
-            }
+            )
             events.append(event)
             
         except Exception as e:
-            log.error(f"Ошибка сбора данных производительности: {e}")
+            log.error("Ошибка сбора данных производительности: %s", e)
             
         return events
 
-    def collect_windows_events(self) -> List[Dict[str, Any]]:
-        """Сбор Windows Event Log через PowerShell (если доступен)"""
+    async def collect_windows_events(self) -> List[Event]:
+        """Сбор Windows Event Log: напрямую через Evt* API (pywin32) или через PowerShell"""
         events = []
+        make = self._event_template()
+        
+        if WIN32EVTLOG_AVAILABLE:
+            try:
+                win_events = await asyncio.to_thread(_read_security_events)
+            except Exception as e:
+                log.debug("Windows Event Log API недоступен или ошибка: %s", e)
+                return events
+        else:
+            win_events = await self._powershell_security_events()
         
+        try:
+            for win_event in win_events:
+                event = make(
+                    _EV_SECURITY,
+                    _SEV_MAP.get(win_event.get('LevelDisplayName'), _SEV_INFO),
+                    {
+                        "windows_event": {
+                            "event_id": win_event.get('Id'),
+                            "level": win_event.get('LevelDisplayName'),
+                            "log_name": win_event.get('LogName'),
+                            "provider_name": win_event.get('ProviderName'),
+                            "message": win_event.get('Message', '')[:500]  # Ограничиваем длину
+                        }
+                    }
+                )
+                events.append(event)
+        except Exception as e:
+            log.debug("Ошибка разбора событий Windows: %s", e)
+            
+        return events
+
+    async def _powershell_security_events(self) -> List[Dict[str, Any]]:
+        """
+        Get-WinEvent | ConvertTo-Json — если pywin32 нет, а PowerShell есть.
+        Один процесс PowerShell живёт всё время работы агента: команда идёт
+        в stdin, конец ответа отмечает строка-маркер.
+        """
         try:
             # Проверяем, доступен ли PowerShell в контейнере
             if os.name == 'nt' or os.path.exists('/usr/bin/pwsh'):
-                powershell_cmd = 'powershell' if os.name == 'nt' else 'pwsh'
-                
-                # Команда для получения последних событий безопасности
-                ps_command = [
-                    powershell_cmd, '-Command',
-                    "Get-WinEvent -FilterHashtable @{LogName='Security'; StartTime=(Get-Date).AddMinutes(-5)} -MaxEvents 10 -ErrorAction SilentlyContinue | ConvertTo-Json"
-                ]
-                
-                result = subprocess.run(ps_command, capture_output=True, text=True, timeout=30)
+                if self._pwsh is None or self._pwsh.returncode is not None:
+                    powershell_cmd = 'powershell' if os.name == 'nt' else 'pwsh'
+                    self._pwsh = await asyncio.create_subprocess_exec(
+                        powershell_cmd, '-NoLogo', '-NoProfile', '-NonInteractive', '-Command', '-',
+                        stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE,
+                        stderr=asyncio.subprocess.DEVNULL)
+                proc = self._pwsh
+                proc.stdin.write(_PS_QUERY.encode() + b"\n")
+                await proc.stdin.drain()
+                try:
+                    stdout = await asyncio.wait_for(self._read_pwsh_reply(proc), timeout=30)
+                except (asyncio.TimeoutError, asyncio.CancelledError):
+                    # ответ не дочитан — поток вывода рассинхронизирован, процесс заменяем
+                    await self._stop_pwsh()
+                    raise
                 
-                if result.returncode == 0 and result.stdout.strip():
+                if stdout.strip():
                     try:
-                        win_events = json.loads(result.stdout)
+                        win_events = json.loads(stdout)
                         if not isinstance(win_events, list):
                             win_events = [win_events]
-                            
-                        for win_event in win_events:
-                            event = {
-                                "timestamp": datetime.utcnow().isoformat() + "Z",
-                                "event_type": "windows.security_event",
-                                "source": "privileged_agent",
-                                "host_id": self.host_id,
-                                "severity": "warning" if win_event.get('LevelDisplayName') == 'Warning' else "info",
-                                "details": {
-                                    "windows_event": {
-                                        "event_id": win_event.get('Id'),
-                                        "level": win_event.get('LevelDisplayName'),
-                                        "log_name": win_event.get('LogName'),
-                                        "provider_name": win_event.get('ProviderName'),
-                                        "message": win_event.get('Message', '')[:500]  # Ограничиваем длину
-                                    }
-                                }
-                            }
-                            events.append(event)
+                        return win_events
                     except json.JSONDecodeError:
                         log.warning("Не удалось распарсить JSON от PowerShell")
                         
         except Exception as e:
-            log.debug(f"PowerShell недоступен или ошибка: {e}")
+            log.debug("PowerShell недоступен или ошибка: %s", e)
+            await self._stop_pwsh()
             
-        return events
+        return []
+
+    @staticmethod
+    async def _read_pwsh_reply(proc: asyncio.subprocess.Process) -> str:
+        """Строки вывода до маркера конца ответа"""
+        lines = []
+        while True:
+            line = await proc.stdout.readline()
+            if not line:
+                raise EOFError("PowerShell завершился")
+            line = line.decode(errors="replace").rstrip("\r\n")
+            if line == _PS_SENTINEL:
+                return "\n".join(lines)
+            lines.append(line)
+
+    async def _stop_pwsh(self) -> None:
+        proc, self._pwsh = self._pwsh, None
+        if proc is not None and proc.returncode is None:
+            proc.kill()
+            await proc.wait()
+
+    async def _get_session(self) -> aiohttp.ClientSession:
+        """Одна keep-alive сессия на всё время работы агента"""
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=4, ssl=False),
+                timeout=aiohttp.ClientTimeout(total=10),
+                headers={"X-API-Key": self.api_key, "Content-Type": "application/json"},
+            )
+        return self._session
 
-    def send_events(self, events: List[Dict[str, Any]]) -> bool:
-        """Отправка событий на сервер"""
+    async def close(self) -> None:
+        if self._session is not None:
+            await self._session.close()
+        await self._stop_pwsh()
+        self._spool.close()
+
+    def spool_events(self, events: List[Any]) -> None:
+        """Сохранить неотправленный пакет; самые старые вытесняются сверх лимита"""
+        self._spool.execute("INSERT INTO q(blob) VALUES(?)", (_dumps(events),))
+        self._spool.execute("DELETE FROM q WHERE id <= (SELECT MAX(id) FROM q) - ?",
+                            (self.SPOOL_MAX_BATCHES,))
+
+    async def drain_spool(self) -> int:
+        """Дослать сохранённые пакеты; остановиться на первой неудаче"""
+        rows = self._spool.execute("SELECT id, blob FROM q ORDER BY id LIMIT ?",
+                                   (self.SPOOL_DRAIN_BATCHES,)).fetchall()
+        sent = 0
+        for row_id, blob in rows:
+            events = json.loads(blob)
+            unsent = await self.send_events(events)
+            sent += len(events) - len(unsent)
+            if unsent:
+                # принятые части пакета второй раз не отправляем
+                self._spool.execute("UPDATE q SET blob = ? WHERE id = ?", (_dumps(unsent), row_id))
+                break
+            self._spool.execute("DELETE FROM q WHERE id = ?", (row_id,))
+        return sent
+
+    async def send_events(self, events: List[Any]) -> List[Any]:
+        """
+        Отправка событий на сервер (Event или словари из очереди на диске)
+        порциями по SEND_CHUNK; возвращает события, которые сервер не принял.
+        """
         if not events:
-            return True
-            
+            return []
+        
         try:
-            url = f"{self.server_url}/api/events/ingest/batch"
-            headers = {
-                "Content-Type": "application/json",
-                "X-API-Key": self.api_key
-            }
-            
-            response = requests.post(
-                url, 
-                json={"items": events}, 
-                headers=headers,
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                log.info(f"Sent {len(events)} events successfully")
-                return True
-            else:
-                log.error(f"Failed to send events: {response.status_code} {response.text}")
-                return False
-                
+            session = await self._get_session()
         except Exception as e:
-            log.error(f"Error sending events: {e}")
-            return False
+            log.error("Error sending events: %s", e)
+            return events
+        
+        chunk_size = self.SEND_CHUNK
+        chunks = [events[i:i + chunk_size] for i in range(0, len(events), chunk_size)]
+        results = await asyncio.gather(*(self._post_chunk(session, chunk) for chunk in chunks))
+        unsent = [event for chunk, ok in zip(chunks, results) if not ok for event in chunk]
+        if len(unsent) < len(events):
+            log.info("Sent %d events successfully", len(events) - len(unsent))
+        return unsent
 
-def main():
+    async def _post_chunk(self, session: aiohttp.ClientSession, events: List[Any]) -> bool:
+        """Одна порция; на 429/503 повторяет после Retry-After"""
+        url = f"{self.server_url}/api/events/ingest/batch"
+        # JSON событий однообразен (source, host_id, event_type) и сжимается
+        # в разы; уровень 1 почти не тратит CPU
+        body = gzip.compress(_dumps({"items": events}), compresslevel=1)
+        for attempt in range(self.SEND_ATTEMPTS):
+            try:
+                async with session.post(url, data=body, headers={"Content-Encoding": "gzip"}) as response:
+                    if response.status == 200:
+                        return True
+                    if response.status not in (429, 503) or attempt == self.SEND_ATTEMPTS - 1:
+                        log.error("Failed to send events: %s %s", response.status, await response.text())
+                        return False
+                    retry_after = response.headers.get("Retry-After", "")
+            except Exception as e:
+                log.error("Error sending events: %s", e)
+                return False
+            # Retry-After в секундах; дату HTTP не разбираем — ждём 1 с
+            delay = min(float(retry_after), self.RETRY_AFTER_MAX) if retry_after.isdigit() else 1.0
+            log.warning("Server busy (%s), retrying in %.0fs", response.status, delay)
+            await asyncio.sleep(delay)
+        return False
+
+async def _bounded(aw, what: str, timeout: float = 25) -> List[Any]:
+    """Результат сборщика или [] — зависший сборщик не задерживает весь цикл"""
+    try:
+        return await asyncio.wait_for(aw, timeout)
+    except asyncio.TimeoutError:
+        log.warning("%s: no result in %ss, skipped this cycle", what, timeout)
+        return []
+
+async def main():
     """Основная функция привилегированного агента"""
     
     # Получаем конфигурацию из переменных окружения
@@ -225,52 +489,69 @@ def main():
         sys.exit(1)
     
     log.info("Privileged agent started")
-    log.info(f"Server: {server_url}")
-    log.info(f"API key: {'***' if api_key else 'NOT SET'}")
-    log.info(f"Host: {socket.gethostname()}")
-    log.info(f"Python: {sys.version}")
-    log.info(f"Privileges: {'ROOT' if os.geteuid() == 0 else 'USER'}" if hasattr(os, 'geteuid') else "WINDOWS")
+    log.info("Server: %s", server_url)
+    log.info("API key: %s", '***' if api_key else 'NOT SET')
+    log.info("Host: %s", socket.gethostname())
+    log.info("Python: %s", sys.version)
+    if hasattr(os, 'geteuid'):
+        log.info("Privileges: %s", 'ROOT' if os.geteuid() == 0 else 'USER')
+    else:
+        log.info("WINDOWS")
     
-    collector = PrivilegedWindowsCollector(server_url, api_key)
+    spool_path = os.environ.get("SPOOL_PATH", "agent_queue.db")
+    collector = PrivilegedWindowsCollector(server_url, api_key, spool_path)
     
     log.info("Starting data collection...")
     
-    while True:
-        try:
-            all_events = []
-            
-            # Collect different types of events
-            log.debug("Collecting system events...")
-            all_events.extend(collector.collect_system_events())
-            
-            log.debug("Collecting network connections...")
-            all_events.extend(collector.collect_network_connections())
-            
-            log.debug("Collecting performance data...")
-            all_events.extend(collector.collect_system_performance())
-            
-            log.debug("Collecting Windows events...")
-            all_events.extend(collector.collect_windows_events())
-            
-            # Send events
-            if all_events:
-                success = collector.send_events(all_events)
-                if success:
-                    log.info(f"Collected and sent {len(all_events)} events")
+    # SIGTERM (docker stop) отменяет цикл: finally ниже успевает всё закрыть
+    try:
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+    except (NotImplementedError, AttributeError):
+        pass  # Windows: остаётся Ctrl+C
+    
+    try:
+        while True:
+            try:
+                # Сборщики работают одновременно: psutil — в пуле потоков,
+                # PowerShell — как асинхронный подпроцесс
+                log.debug("Collecting system events, network connections, performance data, Windows events...")
+                results = await asyncio.gather(
+                    _bounded(asyncio.to_thread(collector.collect_system_events), "System events"),
+                    _bounded(asyncio.to_thread(collector.collect_network_connections), "Network connections"),
+                    _bounded(asyncio.to_thread(collector.collect_system_performance), "Performance"),
+                    _bounded(collector.collect_windows_events(), "Windows events"),
+                )
+                all_events = [event for events in results for event in events]
+                
+                # Сначала досылаем то, что не ушло в прошлых циклах
+                resent = await collector.drain_spool()
+                if resent:
+                    log.info("Resent %d spooled events", resent)
+                
+                # Send events
+                if all_events:
+                    unsent = await collector.send_events(all_events)
+                    if not unsent:
+                        log.info("Collected and sent %d events", len(all_events))
+                    else:
+                        collector.spool_events(unsent)
+                        log.warning("Failed to send %d events, spooled for retry", len(unsent))
                 else:
-                    log.warning(f"Failed to send {len(all_events)} events")
-            else:
-                log.info("No new events to send")
-            
-            # Wait between collection cycles
-            time.sleep(30)
-            
-        except KeyboardInterrupt:
-            log.info("Received shutdown signal")
-            break
-        except Exception as e:
-            log.error(f"Error in main loop: {e}")
-            time.sleep(10)
+                    log.info("No new events to send")
+                
+                # Wait between collection cycles
+                await asyncio.sleep(30)
+                
+            except Exception as e:
+                log.error("Error in main loop: %s", e)
+                await asyncio.sleep(10)
+    finally:
+        await collector.close()
 
 if __name__ == "__main__":
-    main()
+    if UVLOOP_AVAILABLE:
+        asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, asyncio.CancelledError):
+        log.info("Received shutdown signal")
@@ -1,4 +1,5 @@
 # backend/agents/python/sender.py
+import json
 import logging
 import requests
 import time
@@ -6,6 +7,19 @@ from typing import Optional
 
 LOG = logging.getLogger("sender")
 
+# --- orjson (необязательно): сериализация тела запроса в C ---
+try:
+    import orjson
+    _dumps = orjson.dumps
+except ImportError:
+    def _dumps(obj) -> bytes:
+        return json.dumps(obj, separators=(",", ":")).encode()
+
+# Одна keep-alive сессия на процесс: без нового TCP/TLS-рукопожатия на каждый POST
+SESSION = requests.Session()
+SESSION.mount("http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+SESSION.mount("https://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
 def send_event(server_url: str, token: Optional[str], event: dict, verify_tls: bool = False):
     """
     Отправка одного события на backend сервер через HTTP POST.
@@ -14,29 +28,33 @@ def send_event(server_url: str, token: Optional[str], event: dict, verify_tls: b
     headers = {"Content-Type": "application/json"}
     if token:
         headers["Authorization"] = f"Bearer {token}"
+        headers["X-API-Key"] = token
 
-    # Log request details
-    LOG.debug("Sending HTTP POST request:")
-    LOG.debug("   URL: %s", url)
-    LOG.debug("   Headers: %s", headers)
-    LOG.debug("   Event: %s", event)
+    # Подробности запроса и ответа — только при включённом DEBUG
+    debug = LOG.isEnabledFor(logging.DEBUG)
+    if debug:
+        LOG.debug("Sending HTTP POST request:")
+        LOG.debug("   URL: %s", url)
+        LOG.debug("   Headers: %s", headers)
+        LOG.debug("   Event: %s", event)
     
     start_time = time.time()
     
     try:
-        resp = requests.post(url, json=event, headers=headers, verify=verify_tls, timeout=5)
-        end_time = time.time()
+        resp = SESSION.post(url, data=_dumps(event), headers=headers, verify=verify_tls, timeout=5)
         
-        # Log response
-        LOG.debug("HTTP response received in %.3f sec:", end_time - start_time)
-        LOG.debug("   Status: %d", resp.status_code)
-        LOG.debug("   Response: %s", resp.text)
+        if debug:
+            LOG.debug("HTTP response received in %.3f sec:", time.time() - start_time)
+            LOG.debug("   Status: %d", resp.status_code)
+            LOG.debug("   Response: %s", resp.text)
         
+        # тело ответа декодируется только для ошибки
         if resp.status_code != 200:
             LOG.warning("Failed to send event: %s %s", resp.status_code, resp.text)
         else:
             LOG.info("Event sent successfully to %s", url)
-            LOG.debug("   Event ID: %s", event.get('event_type', 'unknown'))
+            if debug:
+                LOG.debug("   Event ID: %s", event.get('event_type', 'unknown'))
             
     except requests.exceptions.Timeout:
         LOG.error("Timeout sending event (5 sec)")
@@ -47,36 +65,58 @@ def send_event(server_url: str, token: Optional[str], event: dict, verify_tls: b
         LOG.exception("Full error traceback:")
 
 
+def endpoint_missing(resp) -> bool:
+    """
+    Ответ означает, что на сервере нет такого эндпоинта: 405, либо 404 не от
+    обработчика (не JSON или стандартный {"detail": "Not Found"} роутера).
+    404 обработчика (например, агент ещё не зарегистрирован) сюда не относится.
+    """
+    if resp.status_code == 405:
+        return True
+    if resp.status_code != 404:
+        return False
+    try:
+        detail = resp.json().get("detail")
+    except (ValueError, AttributeError):
+        return True
+    return detail == "Not Found"
+
+
 def send_batch(server_url: str, token: Optional[str], events: list[dict], verify_tls: bool = False):
     """
     Отправка пачки событий.
+    Возвращает ответ сервера (requests.Response) или None, если запрос не дошёл до сервера.
     """
     url = f"{server_url}/api/events/ingest/batch"
     headers = {"Content-Type": "application/json"}
     if token:
         headers["Authorization"] = f"Bearer {token}"
+        headers["X-API-Key"] = token
 
-    # Log request details
-    LOG.debug("Sending HTTP POST batch request:")
-    LOG.debug("   URL: %s", url)
-    LOG.debug("   Headers: %s", headers)
-    LOG.debug("   Events count: %d", len(events))
+    # Подробности запроса и ответа — только при включённом DEBUG
+    debug = LOG.isEnabledFor(logging.DEBUG)
+    if debug:
+        LOG.debug("Sending HTTP POST batch request:")
+        LOG.debug("   URL: %s", url)
+        LOG.debug("   Headers: %s", headers)
+        LOG.debug("   Events count: %d", len(events))
     
     start_time = time.time()
     
     try:
-        resp = requests.post(url, json={"events": events}, headers=headers, verify=verify_tls, timeout=10)
-        end_time = time.time()
+        resp = SESSION.post(url, data=_dumps({"items": events}), headers=headers, verify=verify_tls, timeout=10)
         
-        # Log response
-        LOG.debug("HTTP batch response received in %.3f sec:", end_time - start_time)
-        LOG.debug("   Status: %d", resp.status_code)
-        LOG.debug("   Response: %s", resp.text)
+        if debug:
+            LOG.debug("HTTP batch response received in %.3f sec:", time.time() - start_time)
+            LOG.debug("   Status: %d", resp.status_code)
+            LOG.debug("   Response: %s", resp.text)
         
+        # тело ответа декодируется только для ошибки
         if resp.status_code != 200:
             LOG.warning("Failed to send batch: %s %s", resp.status_code, resp.text)
         else:
             LOG.info("Batch sent successfully (%d events) to %s", len(events), url)
+        return resp
             
     except requests.exceptions.Timeout:
         LOG.error("Timeout sending batch (10 sec)")
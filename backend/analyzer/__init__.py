@@ -9,19 +9,49 @@ SIEM Analyzer Module
 - Управление алертами
 """
 
-from .engine.analyzer_core import AnalyzerCore
-from .engine.rule_engine import RuleEngine
-from .engine.correlation_engine import CorrelationEngine
-from .engine.threat_intelligence import ThreatIntelligenceService
-from .engine.notification_service import NotificationService
-from .engine.alert_manager import AlertManager
-from .engine.rule import Rule, RuleType, RuleSeverity, RuleMatch, RuleAction, RuleSet
-from .engine.notification_templates import NotificationTemplate, NotificationTemplateManager, template_manager
-from .config import AnalyzerConfig, default_config, create_analyzer_config
-from .utils import (
-    EventMatcher, TimeWindow, EventAggregator, DeduplicationManager,
-    ContextBuilder, ValidationUtils, FileUtils
-)
+import importlib
+
+# Имя -> (модуль относительно пакета, атрибут). Модули движка тянут за собой
+# много зависимостей, поэтому импортируются при первом обращении к имени (PEP 562)
+_LAZY = {
+    "AnalyzerCore": (".engine.analyzer_core", "AnalyzerCore"),
+    "RuleEngine": (".engine.rule_engine", "RuleEngine"),
+    "CorrelationEngine": (".engine.correlation_engine", "CorrelationEngine"),
+    "ThreatIntelligenceService": (".engine.threat_intelligence", "ThreatIntelligenceService"),
+    "NotificationService": (".engine.notification_service", "NotificationService"),
+    "AlertManager": (".engine.alert_manager", "AlertManager"),
+    "Rule": (".engine.rule", "Rule"),
+    "RuleType": (".engine.rule", "RuleType"),
+    "RuleSeverity": (".engine.rule", "RuleSeverity"),
+    "RuleMatch": (".engine.rule", "RuleMatch"),
+    "RuleAction": (".engine.rule", "RuleAction"),
+    "RuleSet": (".engine.rule", "RuleSet"),
+    "NotificationTemplate": (".engine.notification_templates", "NotificationTemplate"),
+    "NotificationTemplateManager": (".engine.notification_templates", "NotificationTemplateManager"),
+    "template_manager": (".engine.notification_templates", "template_manager"),
+    "AnalyzerConfig": (".config", "AnalyzerConfig"),
+    "default_config": (".config", "default_config"),
+    "create_analyzer_config": (".config", "create_analyzer_config"),
+    "EventMatcher": (".utils", "EventMatcher"),
+    "TimeWindow": (".utils", "TimeWindow"),
+    "EventAggregator": (".utils", "EventAggregator"),
+    "DeduplicationManager": (".utils", "DeduplicationManager"),
+    "ContextBuilder": (".utils", "ContextBuilder"),
+    "ValidationUtils": (".utils", "ValidationUtils"),
+    "FileUtils": (".utils", "FileUtils"),
+}
+
+def __getattr__(name):
+    try:
+        module, attr = _LAZY[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module, __name__), attr)
+    globals()[name] = value  # следующие обращения идут мимо __getattr__
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
 
 __version__ = "2.0.0"
 
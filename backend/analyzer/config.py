@@ -3,12 +3,159 @@
 """
 
 import os
-from typing import List, Dict, Any, Optional
-from dataclasses import dataclass, field
+import sys
+import json
+import functools
+from typing import Dict, Any, Mapping, Optional, Tuple, get_origin, get_type_hints
+from dataclasses import dataclass, field, fields
 from pathlib import Path
+from types import MappingProxyType
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
-@dataclass
+
+# Переменная окружения -> поле конфигурации
+_ENV_MAPPING = (
+    ('SIEM_ANALYZER_ENABLED', 'enabled'),
+    ('SIEM_ANALYZER_DEBUG', 'debug'),
+    ('SIEM_ANALYZER_LOG_LEVEL', 'log_level'),
+    ('SIEM_ANALYZER_MAX_CONCURRENT_RULES', 'max_concurrent_rules'),
+    ('SIEM_ANALYZER_EVENT_BATCH_SIZE', 'event_batch_size'),
+    ('SIEM_ANALYZER_PROCESSING_INTERVAL', 'processing_interval'),
+    ('SIEM_ANALYZER_RULES_DIRECTORY', 'rules_directory'),
+    ('SIEM_ANALYZER_BUILTIN_RULES_ENABLED', 'builtin_rules_enabled'),
+    ('SIEM_ANALYZER_CUSTOM_RULES_ENABLED', 'custom_rules_enabled'),
+    ('SIEM_ANALYZER_RULE_RELOAD_INTERVAL', 'rule_reload_interval'),
+    ('SIEM_ANALYZER_NOTIFICATIONS_ENABLED', 'notifications_enabled'),
+    ('SIEM_ANALYZER_CORRELATION_ENABLED', 'correlation_enabled'),
+    ('SIEM_ANALYZER_CORRELATION_WINDOW', 'correlation_window'),
+    ('SIEM_ANALYZER_THREAT_INTELLIGENCE_ENABLED', 'threat_intelligence_enabled'),
+    ('SIEM_ANALYZER_BASELINE_ENABLED', 'baseline_enabled'),
+    ('SIEM_ANALYZER_BASELINE_LEARNING_PERIOD', 'baseline_learning_period'),
+    ('SIEM_ANALYZER_AGENT_NOTIFICATIONS_ENABLED', 'agent_notifications_enabled'),
+    ('SIEM_ANALYZER_EMAIL_ENABLED', 'email_enabled'),
+    ('SIEM_ANALYZER_EMAIL_SMTP_SERVER', 'email_smtp_server'),
+    ('SIEM_ANALYZER_EMAIL_SMTP_PORT', 'email_smtp_port'),
+    ('SIEM_ANALYZER_EMAIL_USERNAME', 'email_username'),
+    ('SIEM_ANALYZER_EMAIL_PASSWORD', 'email_password'),
+    ('SIEM_ANALYZER_EMAIL_FROM', 'email_from'),
+    ('SIEM_ANALYZER_WEBHOOK_ENABLED', 'webhook_enabled'),
+    ('SIEM_ANALYZER_SLACK_ENABLED', 'slack_enabled'),
+    ('SIEM_ANALYZER_TELEGRAM_ENABLED', 'telegram_enabled'),
+)
+
+
+@functools.lru_cache(maxsize=1)
+def _env_snapshot() -> Dict[str, str]:
+    """
+    Заданные переменные SIEM_ANALYZER_*. Окружение читается один раз на процесс;
+    после изменения os.environ нужен _env_snapshot.cache_clear()
+    """
+    # только реально заданные переменные: пересечение множеств ключей
+    return {env_var: os.environ[env_var] for env_var in os.environ.keys() & _ENV_KEYS}
+
+
+# Значения переменных окружения, означающие «включено»
+_TRUTHY = frozenset(('true', '1', 'yes', 'on', 'y', 't'))
+
+
+def _to_bool(value: str) -> bool:
+    # канонические значения ('true', '1') совпадают сразу, без lower()
+    return value in _TRUTHY or value.strip().lower() in _TRUTHY
+
+
+def _to_tuple(value: str) -> Tuple[str, ...]:
+    """'a, b,,c' -> ('a', 'b', 'c'): пробелы обрезаются, пустые элементы отбрасываются"""
+    return tuple(part for part in (item.strip() for item in value.split(',')) if part)
+
+
+# Преобразование строки из окружения по аннотации поля; остальные типы — str
+_CONVERTERS = {
+    bool: _to_bool,
+    int: int,
+    tuple: _to_tuple,
+}
+
+
+# Поля, которые отдаёт to_dict (API /analyzer/config); секреты и служебные
+# настройки (пароли, токены, адреса SMTP/webhook, БД, логирование) не выводятся
+_SERIALIZED_FIELDS = (
+    "enabled",
+    "debug",
+    "log_level",
+    "max_concurrent_rules",
+    "event_batch_size",
+    "processing_interval",
+    "rules_directory",
+    "builtin_rules_enabled",
+    "custom_rules_enabled",
+    "rule_reload_interval",
+    "notifications_enabled",
+    "notification_channels",
+    "correlation_enabled",
+    "correlation_window",
+    "max_correlation_events",
+    "threat_intelligence_enabled",
+    "threat_sources",
+    "baseline_enabled",
+    "baseline_learning_period",
+    "baseline_min_samples",
+    "agent_notifications_enabled",
+    "email_enabled",
+    "webhook_enabled",
+    "slack_enabled",
+    "telegram_enabled",
+)
+
+# Ответ get_notification_config для выключенного или неизвестного канала
+_EMPTY_MAP: Mapping[str, Any] = MappingProxyType({})
+
+# Допустимые каналы уведомлений
+# (интернированы: ключи множеств и _notif_configs совпадают по идентичности)
+_CHANNEL_NAMES = tuple(sys.intern(c) for c in ("agent", "log", "email", "webhook", "slack", "telegram"))
+_VALID_CHANNELS = frozenset(_CHANNEL_NAMES)
+
+
+# Каталог правил -> (mtime, есть ли в нём *.yaml): пока каталог не менялся,
+# его содержимое повторно не читается, в том числе другими экземплярами конфигурации
+_yaml_dir_cache: Dict[str, tuple] = {}
+
+
+def _dir_has_yaml(entry: os.DirEntry) -> bool:
+    """Есть ли в каталоге хотя бы один *.yaml"""
+    mtime = entry.stat().st_mtime_ns
+    key = os.path.abspath(entry.path)
+    cached = _yaml_dir_cache.get(key)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    with os.scandir(entry.path) as entries:
+        # как glob("*.yaml"): скрытые файлы не считаются; достаточно первого совпадения;
+        # is_file() берёт тип из readdir, без отдельного stat
+        found = any(
+            e.name.endswith(".yaml") and not e.name.startswith(".") and e.is_file()
+            for e in entries
+        )
+    _yaml_dir_cache[key] = (mtime, found)
+    return found
+
+
+def _env_overrides() -> Dict[str, Any]:
+    """Значения полей из переменных окружения, уже приведённые к типам полей"""
+    values = {}
+    for env_var, env_value in _env_snapshot().items():
+        attr_name, convert = _ENV_TABLE[env_var]
+        try:
+            values[attr_name] = convert(env_value)
+        except ValueError:
+            # некорректное число — остаётся значение по умолчанию
+            pass
+    return values
+
+
+@dataclass(init=False, slots=True)
 class AnalyzerConfig:
     """Конфигурация анализатора"""
     
@@ -30,9 +177,7 @@ class AnalyzerConfig:
     
     # Настройки уведомлений
     notifications_enabled: bool = True
-    notification_channels: List[str] = field(default_factory=lambda: [
-        "agent", "log", "email", "webhook"
-    ])
+    notification_channels: Tuple[str, ...] = ("agent", "log", "email", "webhook")
     
     # Настройки корреляции
     correlation_enabled: bool = True
@@ -41,9 +186,7 @@ class AnalyzerConfig:
     
     # Настройки угроз
     threat_intelligence_enabled: bool = True
-    threat_sources: List[str] = field(default_factory=lambda: [
-        "local", "abuseipdb", "virustotal"
-    ])
+    threat_sources: Tuple[str, ...] = ("local", "abuseipdb", "virustotal")
     
     # Настройки базовой линии
     baseline_enabled: bool = True
@@ -73,12 +216,12 @@ class AnalyzerConfig:
     email_username: str = ""
     email_password: str = ""
     email_from: str = "siem@company.com"
-    email_to: List[str] = field(default_factory=list)
+    email_to: Tuple[str, ...] = ()
     email_use_tls: bool = True
     
     # Настройки webhook
     webhook_enabled: bool = False
-    webhook_urls: List[str] = field(default_factory=list)
+    webhook_urls: Tuple[str, ...] = ()
     webhook_timeout: int = 10
     webhook_retry_attempts: int = 3
     
@@ -93,61 +236,53 @@ class AnalyzerConfig:
     telegram_bot_token: str = ""
     telegram_chat_id: str = ""
     
-    def __post_init__(self):
-        """Пост-инициализация конфигурации"""
-        # Установка значений по умолчанию из переменных окружения
-        self._load_from_env()
+    # Служебные слоты: производные от полей значения, вне repr/сравнения
+    _channel_set: frozenset = field(default=frozenset(), init=False, repr=False, compare=False)
+    _rules_path: Optional[Path] = field(default=None, init=False, repr=False, compare=False)
+    _notif_configs: Optional[Dict[str, Dict[str, Any]]] = field(default=None, init=False, repr=False, compare=False)
+    
+    def __init__(self, **overrides):
+        """
+        Значения по умолчанию, поверх них переменные окружения, поверх —
+        переданные параметры; каждый слот присваивается один раз
+        """
+        unknown = overrides.keys() - _DEFAULTS.keys()
+        if unknown:
+            raise TypeError(f"Unknown AnalyzerConfig fields: {', '.join(sorted(unknown))}")
         
-        # Валидация конфигурации
-        self._validate()
+        values = dict(_DEFAULTS)
+        values.update(_env_overrides())
+        self._init_from(values, overrides)
+    
+    @classmethod
+    def _derived(cls, base: "AnalyzerConfig", overrides: Dict[str, Any]) -> "AnalyzerConfig":
+        """Копия base с изменёнными полями: окружение уже учтено в base и не перечитывается"""
+        config = cls.__new__(cls)
+        config._init_from({name: getattr(base, name) for name in _DEFAULTS}, overrides)
+        return config
     
-    def _load_from_env(self):
-        """Загрузка конфигурации из переменных окружения"""
-        env_mapping = {
-            'SIEM_ANALYZER_ENABLED': 'enabled',
-            'SIEM_ANALYZER_DEBUG': 'debug',
-            'SIEM_ANALYZER_LOG_LEVEL': 'log_level',
-            'SIEM_ANALYZER_MAX_CONCURRENT_RULES': 'max_concurrent_rules',
-            'SIEM_ANALYZER_EVENT_BATCH_SIZE': 'event_batch_size',
-            'SIEM_ANALYZER_PROCESSING_INTERVAL': 'processing_interval',
-            'SIEM_ANALYZER_RULES_DIRECTORY': 'rules_directory',
-            'SIEM_ANALYZER_BUILTIN_RULES_ENABLED': 'builtin_rules_enabled',
-            'SIEM_ANALYZER_CUSTOM_RULES_ENABLED': 'custom_rules_enabled',
-            'SIEM_ANALYZER_RULE_RELOAD_INTERVAL': 'rule_reload_interval',
-            'SIEM_ANALYZER_NOTIFICATIONS_ENABLED': 'notifications_enabled',
-            'SIEM_ANALYZER_CORRELATION_ENABLED': 'correlation_enabled',
-            'SIEM_ANALYZER_CORRELATION_WINDOW': 'correlation_window',
-            'SIEM_ANALYZER_THREAT_INTELLIGENCE_ENABLED': 'threat_intelligence_enabled',
-            'SIEM_ANALYZER_BASELINE_ENABLED': 'baseline_enabled',
-            'SIEM_ANALYZER_BASELINE_LEARNING_PERIOD': 'baseline_learning_period',
-            'SIEM_ANALYZER_AGENT_NOTIFICATIONS_ENABLED': 'agent_notifications_enabled',
-            'SIEM_ANALYZER_EMAIL_ENABLED': 'email_enabled',
-            'SIEM_ANALYZER_EMAIL_SMTP_SERVER': 'email_smtp_server',
-            'SIEM_ANALYZER_EMAIL_SMTP_PORT': 'email_smtp_port',
-            'SIEM_ANALYZER_EMAIL_USERNAME': 'email_username',
-            'SIEM_ANALYZER_EMAIL_PASSWORD': 'email_password',
-            'SIEM_ANALYZER_EMAIL_FROM': 'email_from',
-            'SIEM_ANALYZER_WEBHOOK_ENABLED': 'webhook_enabled',
-            'SIEM_ANALYZER_SLACK_ENABLED': 'slack_enabled',
-            'SIEM_ANALYZER_TELEGRAM_ENABLED': 'telegram_enabled',
-        }
+    def _init_from(self, values: Dict[str, Any], overrides: Dict[str, Any]) -> None:
+        """Применить overrides поверх values, заполнить слоты и проверить результат"""
+        values.update(overrides)
+        # списки из API/кода приводятся к кортежам, как и значения из окружения
+        for name in _TUPLE_FIELDS & overrides.keys():
+            value = values[name]
+            values[name] = _to_tuple(value) if isinstance(value, str) else tuple(value)
+        if "notification_channels" in overrides:
+            # каналы из API — новые строки; интернируем, чтобы поиск в множестве
+            # и в _notif_configs сводился к сравнению указателей
+            values["notification_channels"] = tuple(
+                sys.intern(c) if isinstance(c, str) else c for c in values["notification_channels"]
+            )
+        for name, value in values.items():
+            setattr(self, name, value)
+        self._rules_path = None
+        # множество для проверок принадлежности; строится по итоговому списку каналов
+        self._channel_set = frozenset(self.notification_channels)
         
-        for env_var, attr_name in env_mapping.items():
-            env_value = os.getenv(env_var)
-            if env_value is not None:
-                # Преобразование типов
-                attr_value = getattr(self, attr_name)
-                if isinstance(attr_value, bool):
-                    setattr(self, attr_name, env_value.lower() in ('true', '1', 'yes', 'on'))
-                elif isinstance(attr_value, int):
-                    try:
-                        setattr(self, attr_name, int(env_value))
-                    except ValueError:
-                        pass
-                elif isinstance(attr_value, list):
-                    setattr(self, attr_name, env_value.split(','))
-                else:
-                    setattr(self, attr_name, env_value)
+        # Валидация конфигурации
+        self._validate()
+        self._notif_configs = self._build_notification_configs()
     
     def _validate(self):
         """Валидация конфигурации"""
@@ -175,64 +310,78 @@ class AnalyzerConfig:
     def _validate_paths(self):
         """Валидация путей к файлам и директориям"""
         try:
-            rules_path = self.get_rules_path()
-            if not rules_path.exists():
+            rules_path = self.rules_path
+            if not self.builtin_rules_enabled:
+                if not rules_path.exists():
+                    raise FileNotFoundError(f"Rules directory not found: {rules_path}")
+                return
+            
+            # Один проход по директории правил: и её наличие, и подкаталог builtin
+            try:
+                with os.scandir(rules_path) as entries:
+                    builtin = next((e for e in entries if e.name == "builtin" and e.is_dir()), None)
+            except FileNotFoundError:
                 raise FileNotFoundError(f"Rules directory not found: {rules_path}")
             
             # Проверка встроенных правил
-            if self.builtin_rules_enabled:
-                builtin_path = rules_path / "builtin"
-                if not builtin_path.exists():
-                    raise FileNotFoundError(f"Builtin rules directory not found: {builtin_path}")
-                
-                # Проверка наличия хотя бы одного файла правил
-                yaml_files = list(builtin_path.glob("*.yaml"))
-                if not yaml_files:
-                    raise FileNotFoundError(f"No YAML rule files found in: {builtin_path}")
+            builtin_path = rules_path / "builtin"
+            if builtin is None:
+                raise FileNotFoundError(f"Builtin rules directory not found: {builtin_path}")
+            
+            # Проверка наличия хотя бы одного файла правил
+            if not _dir_has_yaml(builtin):
+                raise FileNotFoundError(f"No YAML rule files found in: {builtin_path}")
             
         except Exception as e:
             raise ValueError(f"Configuration validation failed: {e}")
     
     def _validate_notification_channels(self):
         """Валидация каналов уведомлений"""
-        valid_channels = ["agent", "log", "email", "webhook", "slack", "telegram"]
-        
+        channels = self._channel_set
         for channel in self.notification_channels:
-            if channel not in valid_channels:
-                raise ValueError(f"Invalid notification channel: {channel}. Valid channels: {valid_channels}")
+            if channel not in _VALID_CHANNELS:
+                raise ValueError(f"Invalid notification channel: {channel}. Valid channels: {list(_CHANNEL_NAMES)}")
         
         # Проверка конфигурации email
-        if "email" in self.notification_channels and self.email_enabled:
+        if "email" in channels and self.email_enabled:
             if not self.email_smtp_server or not self.email_from:
                 raise ValueError("Email configuration incomplete: smtp_server and from are required")
         
         # Проверка конфигурации webhook
-        if "webhook" in self.notification_channels and self.webhook_enabled:
+        if "webhook" in channels and self.webhook_enabled:
             if not self.webhook_urls:
                 raise ValueError("Webhook configuration incomplete: webhook_urls is required")
         
         # Проверка конфигурации Slack
-        if "slack" in self.notification_channels and self.slack_enabled:
+        if "slack" in channels and self.slack_enabled:
             if not self.slack_webhook_url:
                 raise ValueError("Slack configuration incomplete: webhook_url is required")
         
         # Проверка конфигурации Telegram
-        if "telegram" in self.notification_channels and self.telegram_enabled:
+        if "telegram" in channels and self.telegram_enabled:
             if not self.telegram_bot_token or not self.telegram_chat_id:
                 raise ValueError("Telegram configuration incomplete: bot_token and chat_id are required")
     
+    @property
+    def rules_path(self) -> Path:
+        """Путь к директории правил (создаётся один раз на экземпляр)"""
+        if self._rules_path is None:
+            self._rules_path = Path(self.rules_directory)
+        return self._rules_path
+    
     def get_rules_path(self) -> Path:
         """Получить путь к директории правил"""
-        return Path(self.rules_directory)
+        return self.rules_path
     
     def is_channel_enabled(self, channel: str) -> bool:
         """Проверить, включен ли канал уведомлений"""
-        return channel in self.notification_channels
+        return channel in self._channel_set
     
-    def get_notification_config(self, channel: str) -> Dict[str, Any]:
-        """Получить конфигурацию для канала уведомлений"""
-        if channel == "email" and self.email_enabled:
-            return {
+    def _build_notification_configs(self) -> Dict[str, Dict[str, Any]]:
+        """Настройки включённых каналов — один раз, при создании конфигурации"""
+        configs = {}
+        if self.email_enabled:
+            configs["email"] = {
                 "smtp_server": self.email_smtp_server,
                 "smtp_port": self.email_smtp_port,
                 "username": self.email_username,
@@ -241,60 +390,61 @@ class AnalyzerConfig:
                 "to": self.email_to,
                 "use_tls": self.email_use_tls
             }
-        elif channel == "webhook" and self.webhook_enabled:
-            return {
+        if self.webhook_enabled:
+            configs["webhook"] = {
                 "urls": self.webhook_urls,
                 "timeout": self.webhook_timeout,
                 "retry_attempts": self.webhook_retry_attempts
             }
-        elif channel == "slack" and self.slack_enabled:
-            return {
+        if self.slack_enabled:
+            configs["slack"] = {
                 "webhook_url": self.slack_webhook_url,
                 "channel": self.slack_channel,
                 "username": self.slack_username
             }
-        elif channel == "telegram" and self.telegram_enabled:
-            return {
+        if self.telegram_enabled:
+            configs["telegram"] = {
                 "bot_token": self.telegram_bot_token,
                 "chat_id": self.telegram_chat_id
             }
-        elif channel == "agent" and self.agent_notifications_enabled:
-            return {
+        if self.agent_notifications_enabled:
+            configs["agent"] = {
                 "timeout": self.agent_notification_timeout,
                 "retry_attempts": self.agent_retry_attempts
             }
-        else:
-            return {}
+        # Обычные dict: слот должен копироваться и сериализоваться (deepcopy, pickle)
+        return configs
+    
+    def get_notification_config(self, channel: str) -> Mapping[str, Any]:
+        """Получить конфигурацию для канала уведомлений (только для чтения)"""
+        config = self._notif_configs.get(channel)
+        if config is None:
+            return _EMPTY_MAP
+        # Представление только для чтения создаётся на вызов — общий dict не изменить снаружи
+        return MappingProxyType(config)
     
     def to_dict(self) -> Dict[str, Any]:
         """Преобразовать конфигурацию в словарь"""
-        return {
-            "enabled": self.enabled,
-            "debug": self.debug,
-            "log_level": self.log_level,
-            "max_concurrent_rules": self.max_concurrent_rules,
-            "event_batch_size": self.event_batch_size,
-            "processing_interval": self.processing_interval,
-            "rules_directory": self.rules_directory,
-            "builtin_rules_enabled": self.builtin_rules_enabled,
-            "custom_rules_enabled": self.custom_rules_enabled,
-            "rule_reload_interval": self.rule_reload_interval,
-            "notifications_enabled": self.notifications_enabled,
-            "notification_channels": self.notification_channels,
-            "correlation_enabled": self.correlation_enabled,
-            "correlation_window": self.correlation_window,
-            "max_correlation_events": self.max_correlation_events,
-            "threat_intelligence_enabled": self.threat_intelligence_enabled,
-            "threat_sources": self.threat_sources,
-            "baseline_enabled": self.baseline_enabled,
-            "baseline_learning_period": self.baseline_learning_period,
-            "baseline_min_samples": self.baseline_min_samples,
-            "agent_notifications_enabled": self.agent_notifications_enabled,
-            "email_enabled": self.email_enabled,
-            "webhook_enabled": self.webhook_enabled,
-            "slack_enabled": self.slack_enabled,
-            "telegram_enabled": self.telegram_enabled
-        }
+        return {name: getattr(self, name) for name in _SERIALIZED_FIELDS}
+    
+    def to_json(self) -> bytes:
+        """Тот же словарь, сериализованный в JSON (orjson, если установлен)"""
+        if orjson is not None:
+            return orjson.dumps(self.to_dict())
+        return json.dumps(self.to_dict(), ensure_ascii=False).encode()
+
+
+# Значения по умолчанию: все неизменяемые, общие для всех экземпляров
+_DEFAULTS = {f.name: f.default for f in fields(AnalyzerConfig) if f.init}
+
+# Преобразователь выбирается один раз по аннотации поля, а не при каждой загрузке
+_FIELD_HINTS = get_type_hints(AnalyzerConfig)
+_ENV_TABLE = {
+    env_var: (attr_name, _CONVERTERS.get(get_origin(_FIELD_HINTS[attr_name]) or _FIELD_HINTS[attr_name], str))
+    for env_var, attr_name in _ENV_MAPPING
+}
+_ENV_KEYS = frozenset(_ENV_TABLE)
+_TUPLE_FIELDS = frozenset(name for name in _DEFAULTS if get_origin(_FIELD_HINTS[name]) is tuple)
 
 
 # Глобальная конфигурация по умолчанию
@@ -303,10 +453,7 @@ default_config = AnalyzerConfig()
 # Функция для создания конфигурации
 def create_analyzer_config(**kwargs) -> AnalyzerConfig:
     """Создать конфигурацию анализатора с переданными параметрами"""
-    config = AnalyzerConfig()
-    
-    for key, value in kwargs.items():
-        if hasattr(config, key):
-            setattr(config, key, value)
-    
-    return config
+    # неизвестные ключи игнорируются, как и раньше; известные проходят валидацию.
+    # Основа — default_config: значения по умолчанию и окружение уже в нём
+    overrides = {key: value for key, value in kwargs.items() if key in _DEFAULTS}
+    return AnalyzerConfig._derived(default_config, overrides)
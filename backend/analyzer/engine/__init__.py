@@ -10,12 +10,39 @@ Analyzer Engine - Основной движок анализа событий
 - threat_intelligence: Угрозы и разведка
 """
 
-from .rule_engine import RuleEngine
-from .rule import Rule, RuleType, RuleSeverity, RuleMatch
-from .notification_service import NotificationService, NotificationType, NotificationPriority
-from .alert_manager import AlertManager, AlertStatus, AlertLifecycle
-from .correlation_engine import CorrelationEngine, CorrelationRule
-from .threat_intelligence import ThreatIntelligenceService, ThreatIndicator
+import importlib
+
+# Имя -> (модуль относительно пакета, атрибут): импорт при первом обращении
+# (PEP 562), чтобы `from backend.analyzer.engine.rule import Rule` не загружал весь движок
+_LAZY = {
+    "RuleEngine": (".rule_engine", "RuleEngine"),
+    "Rule": (".rule", "Rule"),
+    "RuleType": (".rule", "RuleType"),
+    "RuleSeverity": (".rule", "RuleSeverity"),
+    "RuleMatch": (".rule", "RuleMatch"),
+    "NotificationService": (".notification_service", "NotificationService"),
+    "NotificationType": (".notification_service", "NotificationType"),
+    "NotificationPriority": (".notification_service", "NotificationPriority"),
+    "AlertManager": (".alert_manager", "AlertManager"),
+    "AlertStatus": (".alert_manager", "AlertStatus"),
+    "AlertLifecycle": (".alert_manager", "AlertLifecycle"),
+    "CorrelationEngine": (".correlation_engine", "CorrelationEngine"),
+    "CorrelationRule": (".correlation_engine", "CorrelationRule"),
+    "ThreatIntelligenceService": (".threat_intelligence", "ThreatIntelligenceService"),
+    "ThreatIndicator": (".threat_intelligence", "ThreatIndicator"),
+}
+
+def __getattr__(name):
+    try:
+        module, attr = _LAZY[name]
+    except KeyError:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}") from None
+    value = getattr(importlib.import_module(module, __name__), attr)
+    globals()[name] = value  # следующие обращения идут мимо __getattr__
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(_LAZY))
 
 __all__ = [
     "RuleEngine",
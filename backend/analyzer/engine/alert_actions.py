@@ -4,16 +4,56 @@
 """
 
 from enum import Enum
-from dataclasses import dataclass
-from typing import Dict, List, Optional, Any
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from itertools import islice
+from typing import Callable, Dict, List, Optional, Any, Sequence, Tuple
 from datetime import datetime, timedelta
+import ast
 import asyncio
-import subprocess
+import heapq
+import ipaddress
 import json
 import logging
+import operator
+import os
+import re
+import time
+import zlib
 
 logger = logging.getLogger(__name__)
 
+# --- orjson (необязательно): быстрая сериализация журналируемых событий ---
+try:
+    import orjson
+    
+    def _dumps(obj) -> str:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode()
+except ImportError:
+    _dumps = json.dumps
+
+# --- pyroute2 (необязательно): блокировки через ipset напрямую по netlink ---
+try:
+    from pyroute2 import IPSet
+    from pyroute2.netlink.exceptions import NetlinkError
+except ImportError:
+    IPSet = None
+    NetlinkError = OSError
+
+# Самое частое условие вида "confidence > 0.9" вычисляется без eval
+_CONFIDENCE_CONDITION = re.compile(r"\s*confidence\s*(>=|<=|>|<)\s*([0-9]*\.?[0-9]+)\s*")
+_COMPARISONS = {">": operator.gt, ">=": operator.ge, "<": operator.lt, "<=": operator.le}
+
+# Остальные условия: только сравнения и логика над полями контекста
+_CONDITION_NAMES = ("confidence", "severity", "source_ip", "target_ip")
+_CONDITION_NODES = (
+    ast.Expression, ast.Compare, ast.BoolOp, ast.UnaryOp, ast.Name, ast.Constant,
+    ast.Tuple, ast.List, ast.Load, ast.And, ast.Or, ast.Not,
+    ast.Eq, ast.NotEq, ast.Lt, ast.LtE, ast.Gt, ast.GtE, ast.In, ast.NotIn, ast.Is, ast.IsNot,
+)
+
 class AlertType(Enum):
     """Типы алертов безопасности"""
     DDOS_SYN_FLOOD = "ddos_syn_flood"
@@ -46,7 +86,12 @@ class ActionSeverity(Enum):
     HIGH = "high"
     CRITICAL = "critical"
 
-@dataclass
+# Строковые значения членов перечислений: поиск в словаре вместо дескриптора .value
+_ALERT_TYPE_VALUES = {member: member.value for member in AlertType}
+_ACTION_TYPE_VALUES = {member: member.value for member in ActionType}
+_SEVERITY_VALUES = {member: member.value for member in ActionSeverity}
+
+@dataclass(slots=True)
 class AlertContext:
     """Контекст алерта для принятия решений"""
     alert_type: AlertType
@@ -60,231 +105,320 @@ class AlertContext:
     mac_address: Optional[str] = None
     severity: ActionSeverity = ActionSeverity.MEDIUM
     confidence: float = 0.8
-    timestamp: datetime = None
-    additional_data: Dict[str, Any] = None
-    
-    def __post_init__(self):
-        if self.timestamp is None:
-            self.timestamp = datetime.now()
-        if self.additional_data is None:
-            self.additional_data = {}
+    timestamp: datetime = field(default_factory=datetime.now)
+    additional_data: Dict[str, Any] = field(default_factory=dict)
 
-@dataclass
+@dataclass(slots=True)
 class ActionConfig:
     """Конфигурация действия"""
     action_type: ActionType
     enabled: bool = True
     auto_execute: bool = False
     ttl_minutes: int = 60
-    parameters: Dict[str, Any] = None
-    conditions: List[str] = None  # Условия для выполнения
-    
-    def __post_init__(self):
-        if self.parameters is None:
-            self.parameters = {}
-        if self.conditions is None:
-            self.conditions = []
+    parameters: Dict[str, Any] = field(default_factory=dict)
+    conditions: List[str] = field(default_factory=list)  # Условия для выполнения
+
+# Действия по умолчанию для каждого типа алерта: собираются один раз при импорте
+# и разделяются экземплярами движка (API заменяет список типа целиком, а не изменяет его)
+_DEFAULT_ACTION_CONFIGS: Dict[AlertType, Tuple[ActionConfig, ...]] = {
+    # DDoS атаки
+    AlertType.DDOS_SYN_FLOOD: (
+        ActionConfig(
+            action_type=ActionType.RATE_LIMIT,
+            auto_execute=True,
+            ttl_minutes=30,
+            parameters={"max_connections_per_second": 10}
+        ),
+        ActionConfig(
+            action_type=ActionType.BLOCK_IP,
+            auto_execute=False,  # Требует подтверждения
+            ttl_minutes=60,
+            conditions=["confidence > 0.9"]
+        ),
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        )
+    ),
+    
+    AlertType.DDOS_HTTP_RPS: (
+        ActionConfig(
+            action_type=ActionType.RATE_LIMIT,
+            auto_execute=True,
+            ttl_minutes=15,
+            parameters={"max_requests_per_second": 50}
+        ),
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        )
+    ),
+    
+    # Сканирование портов
+    AlertType.PORT_SCAN: (
+        ActionConfig(
+            action_type=ActionType.BLOCK_IP,
+            auto_execute=True,
+            ttl_minutes=120,
+            conditions=["confidence > 0.8"]
+        ),
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        )
+    ),
+    
+    # Брутфорс атаки
+    AlertType.BRUTEFORCE_SSH: (
+        ActionConfig(
+            action_type=ActionType.BLOCK_IP,
+            auto_execute=True,
+            ttl_minutes=180,
+            conditions=["confidence > 0.7"]
+        ),
+        ActionConfig(
+            action_type=ActionType.RESTART_SERVICE,
+            auto_execute=False,
+            parameters={"service": "ssh"}
+        ),
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        )
+    ),
+    
+    AlertType.BRUTEFORCE_HTTP: (
+        ActionConfig(
+            action_type=ActionType.RATE_LIMIT,
+            auto_execute=True,
+            ttl_minutes=60,
+            parameters={"max_requests_per_minute": 10}
+        ),
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        )
+    ),
+    
+    # ARP атаки
+    AlertType.ARP_SPOOF: (
+        ActionConfig(
+            action_type=ActionType.ISOLATE_HOST,
+            auto_execute=True,
+            ttl_minutes=300,
+            conditions=["confidence > 0.9"]
+        ),
+        ActionConfig(
+            action_type=ActionType.FLUSH_CACHE,
+            auto_execute=True,
+            parameters={"cache_type": "arp"}
+        ),
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        )
+    ),
+    
+    AlertType.ARP_FLOOD: (
+        ActionConfig(
+            action_type=ActionType.ISOLATE_HOST,
+            auto_execute=True,
+            ttl_minutes=60
+        ),
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        )
+    ),
+    
+    # DNS атаки
+    AlertType.DNS_NXDOMAIN_FLOOD: (
+        ActionConfig(
+            action_type=ActionType.RATE_LIMIT,
+            auto_execute=True,
+            ttl_minutes=30,
+            parameters={"max_queries_per_second": 20}
+        ),
+        ActionConfig(
+            action_type=ActionType.RESTART_SERVICE,
+            auto_execute=False,
+            parameters={"service": "named"}
+        ),
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        )
+    ),
+    
+    AlertType.DNS_RANDOM_SUBDOMAINS: (
+        ActionConfig(
+            action_type=ActionType.BLOCK_IP,
+            auto_execute=True,
+            ttl_minutes=90
+        ),
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        )
+    ),
+    
+    # Другие типы алертов
+    AlertType.LATERAL_MOVEMENT: (
+        ActionConfig(
+            action_type=ActionType.ISOLATE_HOST,
+            auto_execute=False,  # Требует ручного подтверждения
+            ttl_minutes=1440  # 24 часа
+        ),
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        )
+    ),
+    
+    AlertType.ANOMALY_DETECTION: (
+        ActionConfig(
+            action_type=ActionType.NOTIFY_ADMIN,
+            auto_execute=True
+        ),
+        ActionConfig(
+            action_type=ActionType.LOG_EVENT,
+            auto_execute=True
+        )
+    )
+}
 
 class AlertActionEngine:
     """Движок выполнения действий по алертам"""
     
+    # Правила iptables копятся не дольше RULE_BATCH_WINDOW секунд или до
+    # RULE_BATCH_MAX штук и применяются одним вызовом iptables-restore
+    RULE_BATCH_WINDOW = 0.05
+    RULE_BATCH_MAX = 32
+    # Через сколько секунд повторить неудавшееся снятие блокировки
+    UNBLOCK_RETRY_SEC = 60
+    
+    # Точный повтор алерта (тип, IP, важность, уверенность) в течение DEDUP_TTL
+    # секунд после автоматически выполненных действий не запускает конвейер заново
+    DEDUP_TTL = 1.0
+    DEDUP_MAX = 4096
+    
+    # Уведомления администратору копятся NOTIFY_FLUSH_INTERVAL секунд и
+    # отправляются одной сводкой на пару (тип алерта, IP)
+    NOTIFY_FLUSH_INTERVAL = 2.0
+    
+    # ipset с заблокированными адресами; в INPUT на него ссылается одно правило DROP
+    BLOCK_SET = "siem_blocklist"
+    
     def __init__(self):
-        self.action_configs: Dict[AlertType, List[ActionConfig]] = {}
+        self.action_configs: Dict[AlertType, Sequence[ActionConfig]] = {}
         self.active_blocks: Dict[str, datetime] = {}  # IP -> время блокировки
-        self.action_history: List[Dict] = []
+        self._expiry_heap: List[Tuple[float, str]] = []  # (время истечения, IP)
+        # Ограниченная история: старые записи вытесняются за O(1)
+        self.action_history: deque = deque(maxlen=int(os.environ.get("SIEM_HISTORY_MAX", 10000)))
+        self._pending_rules: List[Tuple[str, str, asyncio.Future]] = []  # (операция, IP, результат)
+        self._rules_full: Optional[asyncio.Event] = None
+        self._rules_task: Optional[asyncio.Task] = None
+        self._cond_cache: Dict[str, Callable[[AlertContext], bool]] = {}  # условие -> предикат
+        # Обработчики действий разрешаются один раз, а не цепочкой if/elif
+        self._dispatch: Dict[ActionType, Callable] = {
+            ActionType.BLOCK_IP: self._exec_block_ip,
+            ActionType.RATE_LIMIT: self._exec_rate_limit,
+            ActionType.ISOLATE_HOST: self._exec_isolate_host,
+            ActionType.RESTART_SERVICE: self._exec_restart_service,
+            ActionType.FLUSH_CACHE: self._exec_flush_cache,
+            ActionType.NOTIFY_ADMIN: self._exec_notify_admin,
+            ActionType.LOG_EVENT: self._exec_log_event,
+            ActionType.CUSTOM_SCRIPT: self._exec_custom_script,
+        }
+        # Тип алерта -> (список конфигураций, из которого собран конвейер; конвейер)
+        self._pipelines: Dict[AlertType, Tuple[Sequence[ActionConfig], Tuple]] = {}
+        self._recent: OrderedDict = OrderedDict()  # ключ дедупликации -> время обработки
+        # ipset через netlink: None — еще не проверялся, False — недоступен (нет pyroute2/CAP_NET_ADMIN)
+        self._ipset = None
+        self._ipset_ready: Optional[bool] = None
+        # Параллельные вызовы ждут единственную настройку ipset, а не уходят в iptables
+        self._ipset_lock = asyncio.Lock()
+        self._ipset_executor: Optional[ThreadPoolExecutor] = None
+        self._notify_queue: asyncio.Queue = asyncio.Queue()
+        self._notify_task: Optional[asyncio.Task] = None
+        # Базовое окружение пользовательских скриптов (PATH, HOME и т.д.)
+        self._script_env_base: Dict[str, str] = os.environ.copy()
         self._setup_default_actions()
     
     def _setup_default_actions(self):
         """Настройка действий по умолчанию для каждого типа алерта"""
-        
-        # DDoS атаки
-        self.action_configs[AlertType.DDOS_SYN_FLOOD] = [
-            ActionConfig(
-                action_type=ActionType.RATE_LIMIT,
-                auto_execute=True,
-                ttl_minutes=30,
-                parameters={"max_connections_per_second": 10}
-            ),
-            ActionConfig(
-                action_type=ActionType.BLOCK_IP,
-                auto_execute=False,  # Требует подтверждения
-                ttl_minutes=60,
-                conditions=["confidence > 0.9"]
-            ),
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            )
-        ]
-        
-        self.action_configs[AlertType.DDOS_HTTP_RPS] = [
-            ActionConfig(
-                action_type=ActionType.RATE_LIMIT,
-                auto_execute=True,
-                ttl_minutes=15,
-                parameters={"max_requests_per_second": 50}
-            ),
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            )
-        ]
-        
-        # Сканирование портов
-        self.action_configs[AlertType.PORT_SCAN] = [
-            ActionConfig(
-                action_type=ActionType.BLOCK_IP,
-                auto_execute=True,
-                ttl_minutes=120,
-                conditions=["confidence > 0.8"]
-            ),
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            )
-        ]
-        
-        # Брутфорс атаки
-        self.action_configs[AlertType.BRUTEFORCE_SSH] = [
-            ActionConfig(
-                action_type=ActionType.BLOCK_IP,
-                auto_execute=True,
-                ttl_minutes=180,
-                conditions=["confidence > 0.7"]
-            ),
-            ActionConfig(
-                action_type=ActionType.RESTART_SERVICE,
-                auto_execute=False,
-                parameters={"service": "ssh"}
-            ),
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            )
-        ]
-        
-        self.action_configs[AlertType.BRUTEFORCE_HTTP] = [
-            ActionConfig(
-                action_type=ActionType.RATE_LIMIT,
-                auto_execute=True,
-                ttl_minutes=60,
-                parameters={"max_requests_per_minute": 10}
-            ),
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            )
-        ]
-        
-        # ARP атаки
-        self.action_configs[AlertType.ARP_SPOOF] = [
-            ActionConfig(
-                action_type=ActionType.ISOLATE_HOST,
-                auto_execute=True,
-                ttl_minutes=300,
-                conditions=["confidence > 0.9"]
-            ),
-            ActionConfig(
-                action_type=ActionType.FLUSH_CACHE,
-                auto_execute=True,
-                parameters={"cache_type": "arp"}
-            ),
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            )
-        ]
-        
-        self.action_configs[AlertType.ARP_FLOOD] = [
-            ActionConfig(
-                action_type=ActionType.ISOLATE_HOST,
-                auto_execute=True,
-                ttl_minutes=60
-            ),
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            )
-        ]
-        
-        # DNS атаки
-        self.action_configs[AlertType.DNS_NXDOMAIN_FLOOD] = [
-            ActionConfig(
-                action_type=ActionType.RATE_LIMIT,
-                auto_execute=True,
-                ttl_minutes=30,
-                parameters={"max_queries_per_second": 20}
-            ),
-            ActionConfig(
-                action_type=ActionType.RESTART_SERVICE,
-                auto_execute=False,
-                parameters={"service": "named"}
-            ),
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            )
-        ]
-        
-        self.action_configs[AlertType.DNS_RANDOM_SUBDOMAINS] = [
-            ActionConfig(
-                action_type=ActionType.BLOCK_IP,
-                auto_execute=True,
-                ttl_minutes=90
-            ),
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            )
-        ]
-        
-        # Другие типы алертов
-        self.action_configs[AlertType.LATERAL_MOVEMENT] = [
-            ActionConfig(
-                action_type=ActionType.ISOLATE_HOST,
-                auto_execute=False,  # Требует ручного подтверждения
-                ttl_minutes=1440  # 24 часа
-            ),
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            )
-        ]
-        
-        self.action_configs[AlertType.ANOMALY_DETECTION] = [
-            ActionConfig(
-                action_type=ActionType.NOTIFY_ADMIN,
-                auto_execute=True
-            ),
-            ActionConfig(
-                action_type=ActionType.LOG_EVENT,
-                auto_execute=True
+        self.action_configs.update(_DEFAULT_ACTION_CONFIGS)
+        self._compile_pipelines()
+    
+    def _compile_pipelines(self):
+        """Сборка конвейеров действий для всех типов алертов"""
+        for alert_type, configs in self.action_configs.items():
+            self._compile_pipeline(alert_type, configs)
+    
+    def _compile_checks(self, conditions: List[str]) -> Optional[Callable[[AlertContext], bool]]:
+        """Объединение условий действия в одну проверку; None — условий нет"""
+        predicates = tuple(self._compile_condition(condition) for condition in conditions)
+        if not predicates:
+            return None
+        if len(predicates) == 1:
+            return predicates[0]
+        return lambda context: all(predicate(context) for predicate in predicates)
+    
+    def _compile_pipeline(self, alert_type: AlertType, configs: Sequence[ActionConfig]) -> Tuple:
+        """Сборка конвейера (обработчик, конфигурация, проверка условий) для типа алерта"""
+        pipeline = tuple(
+            (
+                self._dispatch.get(config.action_type),
+                config,
+                self._compile_checks(config.conditions)
             )
-        ]
+            for config in configs
+        )
+        self._pipelines[alert_type] = (configs, pipeline)
+        return pipeline
     
     async def process_alert(self, context: AlertContext) -> List[Dict]:
         """Обработка алерта и выполнение соответствующих действий"""
         actions_performed = []
         
-        if context.alert_type not in self.action_configs:
+        configs = self.action_configs.get(context.alert_type)
+        if configs is None:
             logger.warning(f"No action config for alert type: {context.alert_type}")
             return actions_performed
         
-        configs = self.action_configs[context.alert_type]
+        # Конвейер пересобирается, только если конфигурации типа были заменены
+        compiled = self._pipelines.get(context.alert_type)
+        if compiled is not None and compiled[0] is configs:
+            pipeline = compiled[1]
+        else:
+            pipeline = self._compile_pipeline(context.alert_type, configs)
+        
+        dedup_key = self._dedup_key(context)
+        if dedup_key is not None and self._is_duplicate(dedup_key):
+            return actions_performed
+        
+        # Одна метка времени на алерт для всех его действий
+        now_iso = datetime.now().isoformat()
+        context_record = None
+        executed = False
         
-        for config in configs:
+        for handler, config, check in pipeline:
             if not config.enabled:
                 continue
                 
-            # Проверяем условия выполнения
-            if not self._check_conditions(config, context):
+            # Проверяем условия выполнения (для действий без условий — без вызова)
+            if check is not None and not check(context):
                 continue
             
             # Выполняем действие
             try:
                 if config.auto_execute:
-                    result = await self._execute_action(config, context)
+                    # Описание контекста одно на алерт и разделяется записями всех его действий
+                    if context_record is None:
+                        context_record = self._context_record(context)
+                    result = await self._execute_action(config, context, handler, now_iso, context_record)
                     actions_performed.append(result)
+                    executed = True
                 else:
                     # Добавляем в очередь для ручного подтверждения
                     await self._queue_for_approval(config, context)
@@ -292,85 +426,135 @@ class AlertActionEngine:
             except Exception as e:
                 logger.error(f"Error executing action {config.action_type}: {e}")
                 actions_performed.append({
-                    "action": config.action_type.value,
+                    "action": _ACTION_TYPE_VALUES[config.action_type],
                     "status": "error",
                     "error": str(e),
-                    "timestamp": datetime.now().isoformat()
+                    "timestamp": now_iso
                 })
         
+        # Повтор подавляется, только если этот алерт действительно что-то выполнил
+        if executed and dedup_key is not None:
+            self._remember(dedup_key)
         return actions_performed
     
-    def _check_conditions(self, config: ActionConfig, context: AlertContext) -> bool:
-        """Проверка условий для выполнения действия"""
-        if not config.conditions:
-            return True
+    @staticmethod
+    def _dedup_key(context: AlertContext) -> Optional[Tuple]:
+        """Ключ дедупликации; None — алерт без IP источника не дедуплицируется"""
+        if context.source_ip is None:
+            return None
+        # Важность и уверенность входят в ключ: повтор с другими значениями
+        # может выполнить условие, не выполненное в первый раз
+        return (context.alert_type, context.source_ip, context.severity, context.confidence)
+    
+    def _is_duplicate(self, key: Tuple) -> bool:
+        """Проверка, выполнялись ли действия для такого же алерта в последние DEDUP_TTL секунд"""
+        recent = self._recent
         
-        for condition in config.conditions:
-            if not self._evaluate_condition(condition, context):
-                return False
+        # Записи упорядочены по времени: истекшие всегда в начале
+        deadline = time.monotonic() - self.DEDUP_TTL
+        while recent:
+            _, seen = next(iter(recent.items()))
+            if seen > deadline:
+                break
+            recent.popitem(last=False)
+        return key in recent
+    
+    def _remember(self, key: Tuple):
+        """Запоминание алерта, для которого были выполнены действия"""
+        recent = self._recent
+        recent.pop(key, None)  # повторная запись уходит в конец, порядок по времени сохраняется
+        recent[key] = time.monotonic()
+        if len(recent) > self.DEDUP_MAX:
+            recent.popitem(last=False)
+    
+    def _compile_condition(self, condition: str) -> Callable[[AlertContext], bool]:
+        """Компиляция условия в предикат (один раз на строку условия)"""
+        predicate = self._cond_cache.get(condition)
+        if predicate is not None:
+            return predicate
         
-        return True
+        match = _CONFIDENCE_CONDITION.fullmatch(condition)
+        if match:
+            compare, threshold = _COMPARISONS[match.group(1)], float(match.group(2))
+            predicate = lambda context: compare(context.confidence, threshold)
+        else:
+            predicate = self._compile_expression(condition)
+        
+        self._cond_cache[condition] = predicate
+        return predicate
     
-    def _evaluate_condition(self, condition: str, context: AlertContext) -> bool:
-        """Вычисление условия (простая реализация)"""
+    @staticmethod
+    def _compile_expression(condition: str) -> Callable[[AlertContext], bool]:
+        """Компиляция произвольного условия в функцию от полей контекста.
+        
+        Условие разбирается в AST и допускается только из сравнений, логических
+        операций и констант над именами из _CONDITION_NAMES; остальные условия
+        отклоняются с предупреждением и всегда ложны.
+        """
         try:
-            # Подставляем значения из контекста
-            local_vars = {
-                'confidence': context.confidence,
-                'severity': context.severity.value,
-                'source_ip': context.source_ip,
-                'target_ip': context.target_ip
-            }
-            return eval(condition, {"__builtins__": {}}, local_vars)
-        except:
-            return False
+            tree = ast.parse(condition.strip(), mode="eval")
+            for node in ast.walk(tree):
+                if not isinstance(node, _CONDITION_NODES):
+                    raise ValueError(f"{type(node).__name__} is not allowed")
+                if isinstance(node, ast.Name) and node.id not in _CONDITION_NAMES:
+                    raise ValueError(f"unknown name {node.id!r}")
+            # Проверенное выражение становится телом функции: без dict и eval на каждый вызов
+            func = eval(
+                compile(f"lambda {', '.join(_CONDITION_NAMES)}: ({condition.strip()})", "<condition>", "eval"),
+                {"__builtins__": {}}
+            )
+        except (SyntaxError, ValueError) as e:
+            logger.warning(f"Rejected action condition {condition!r}: {e}")
+            return lambda context: False
+        
+        warned = False
+        
+        def predicate(context: AlertContext) -> bool:
+            nonlocal warned
+            try:
+                # Подставляем значения из контекста
+                return bool(func(
+                    context.confidence,
+                    _SEVERITY_VALUES[context.severity],
+                    context.source_ip,
+                    context.target_ip
+                ))
+            except TypeError as e:
+                # Например, сравнение None с числом; сообщаем один раз на условие
+                if not warned:
+                    warned = True
+                    logger.warning(f"Action condition {condition!r} failed: {e}")
+                return False
+        
+        return predicate
     
-    async def _execute_action(self, config: ActionConfig, context: AlertContext) -> Dict:
+    @staticmethod
+    def _context_record(context: AlertContext) -> Dict:
+        """Описание контекста алерта для записи в историю действий"""
+        return {
+            "alert_type": _ALERT_TYPE_VALUES[context.alert_type],
+            "source_ip": context.source_ip,
+            "target_ip": context.target_ip,
+            "severity": _SEVERITY_VALUES[context.severity]
+        }
+    
+    async def _execute_action(self, config: ActionConfig, context: AlertContext,
+                              handler: Optional[Callable] = None, timestamp: Optional[str] = None,
+                              context_record: Optional[Dict] = None) -> Dict:
         """Выполнение конкретного действия"""
         action_result = {
-            "action": config.action_type.value,
-            "context": {
-                "alert_type": context.alert_type.value,
-                "source_ip": context.source_ip,
-                "target_ip": context.target_ip,
-                "severity": context.severity.value
-            },
-            "timestamp": datetime.now().isoformat(),
+            "action": _ACTION_TYPE_VALUES[config.action_type],
+            "context": context_record or self._context_record(context),
+            "timestamp": timestamp or datetime.now().isoformat(),
             "status": "success"
         }
         
+        if handler is None:
+            handler = self._dispatch.get(config.action_type)
+        
         try:
-            if config.action_type == ActionType.BLOCK_IP:
-                await self._block_ip(context.source_ip, config.ttl_minutes)
-                action_result["details"] = f"Blocked IP {context.source_ip} for {config.ttl_minutes} minutes"
-                
-            elif config.action_type == ActionType.RATE_LIMIT:
-                await self._apply_rate_limit(context, config.parameters)
-                action_result["details"] = f"Applied rate limiting: {config.parameters}"
-                
-            elif config.action_type == ActionType.ISOLATE_HOST:
-                await self._isolate_host(context.source_ip, config.ttl_minutes)
-                action_result["details"] = f"Isolated host {context.source_ip} for {config.ttl_minutes} minutes"
-                
-            elif config.action_type == ActionType.RESTART_SERVICE:
-                await self._restart_service(config.parameters.get("service"))
-                action_result["details"] = f"Restarted service: {config.parameters.get('service')}"
-                
-            elif config.action_type == ActionType.FLUSH_CACHE:
-                await self._flush_cache(config.parameters.get("cache_type"))
-                action_result["details"] = f"Flushed {config.parameters.get('cache_type')} cache"
-                
-            elif config.action_type == ActionType.NOTIFY_ADMIN:
-                await self._notify_admin(context)
-                action_result["details"] = "Admin notification sent"
-                
-            elif config.action_type == ActionType.LOG_EVENT:
-                await self._log_event(context)
-                action_result["details"] = "Event logged"
-                
-            elif config.action_type == ActionType.CUSTOM_SCRIPT:
-                await self._run_custom_script(config.parameters, context)
-                action_result["details"] = f"Custom script executed: {config.parameters.get('script')}"
+            if handler is not None:
+                action_result["details"] = await handler(config, context)
         
         except Exception as e:
             action_result["status"] = "error"
@@ -381,27 +565,237 @@ class AlertActionEngine:
         
         return action_result
     
+    async def _exec_block_ip(self, config: ActionConfig, context: AlertContext) -> str:
+        await self._block_ip(context.source_ip, config.ttl_minutes)
+        return f"Blocked IP {context.source_ip} for {config.ttl_minutes} minutes"
+    
+    async def _exec_rate_limit(self, config: ActionConfig, context: AlertContext) -> str:
+        await self._apply_rate_limit(context, config.parameters)
+        return f"Applied rate limiting: {config.parameters}"
+    
+    async def _exec_isolate_host(self, config: ActionConfig, context: AlertContext) -> str:
+        await self._isolate_host(context.source_ip, config.ttl_minutes)
+        return f"Isolated host {context.source_ip} for {config.ttl_minutes} minutes"
+    
+    async def _exec_restart_service(self, config: ActionConfig, context: AlertContext) -> str:
+        await self._restart_service(config.parameters.get("service"))
+        return f"Restarted service: {config.parameters.get('service')}"
+    
+    async def _exec_flush_cache(self, config: ActionConfig, context: AlertContext) -> str:
+        await self._flush_cache(config.parameters.get("cache_type"))
+        return f"Flushed {config.parameters.get('cache_type')} cache"
+    
+    async def _exec_notify_admin(self, config: ActionConfig, context: AlertContext) -> str:
+        await self._notify_admin(context)
+        return "Admin notification queued"
+    
+    async def _exec_log_event(self, config: ActionConfig, context: AlertContext) -> str:
+        await self._log_event(context)
+        return "Event logged"
+    
+    async def _exec_custom_script(self, config: ActionConfig, context: AlertContext) -> str:
+        await self._run_custom_script(config.parameters, context)
+        return f"Custom script executed: {config.parameters.get('script')}"
+    
+    @staticmethod
+    async def _run_command(cmd: List[str], timeout: float, env: Optional[Dict[str, str]] = None,
+                           stdin_data: Optional[bytes] = None, capture_stdout: bool = False):
+        """Запуск внешней команды без блокировки event loop.
+        
+        Возвращает (код возврата, stdout, stderr). stdout читается только при
+        capture_stdout=True, иначе уходит в /dev/null без лишнего канала.
+        """
+        proc = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.PIPE if stdin_data is not None else None,
+            stdout=asyncio.subprocess.PIPE if capture_stdout else asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+            env=env
+        )
+        try:
+            stdout, stderr = await asyncio.wait_for(proc.communicate(stdin_data), timeout=timeout)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise
+        return (
+            proc.returncode,
+            stdout.decode(errors="replace") if stdout else "",
+            stderr.decode(errors="replace")
+        )
+    
+    def _queue_rule(self, op: str, ip: str) -> asyncio.Future:
+        """Постановка правила INPUT DROP (op: -I / -D) в очередь пакетного применения"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        address = _parse_ipv4(ip)
+        if address is None:
+            logger.error(f"Refusing iptables rule for invalid IPv4 address {ip!r}")
+            future.set_result(False)
+            return future
+        self._pending_rules.append((op, address, future))
+        
+        if self._rules_task is None or self._rules_task.done():
+            self._rules_full = asyncio.Event()
+            self._rules_task = loop.create_task(self._flush_rules())
+        elif len(self._pending_rules) >= self.RULE_BATCH_MAX:
+            self._rules_full.set()
+        return future
+    
+    async def _flush_rules(self):
+        """Применение накопленных правил через iptables-restore --noflush"""
+        while self._pending_rules:
+            if len(self._pending_rules) < self.RULE_BATCH_MAX:
+                try:
+                    await asyncio.wait_for(self._rules_full.wait(), timeout=self.RULE_BATCH_WINDOW)
+                except asyncio.TimeoutError:
+                    pass
+            self._rules_full.clear()
+            
+            batch, self._pending_rules = self._pending_rules, []
+            inserts = [(ip, future) for op, ip, future in batch if op == "-I"]
+            deletes = [(ip, future) for op, ip, future in batch if op != "-I"]
+            
+            # Вставки и удаления — разные транзакции: -D уже отсутствующего правила
+            # откатывает весь COMMIT и не должен срывать блокировки из того же пакета
+            if inserts:
+                self._resolve_rules(inserts, await self._restore_rules("-I", [ip for ip, _ in inserts]))
+            if deletes:
+                if await self._restore_rules("-D", [ip for ip, _ in deletes]):
+                    self._resolve_rules(deletes, True)
+                elif len(deletes) > 1:
+                    # Пакет удалений откатился — повторяем по одному правилу
+                    results = await asyncio.gather(*(self._restore_rules("-D", [ip]) for ip, _ in deletes))
+                    for entry, ok in zip(deletes, results):
+                        self._resolve_rules([entry], ok)
+                else:
+                    self._resolve_rules(deletes, False)
+    
+    @staticmethod
+    def _resolve_rules(entries: List[Tuple[str, asyncio.Future]], ok: bool):
+        """Передача результата транзакции ожидающим вызовам"""
+        for _, future in entries:
+            if not future.done():
+                future.set_result(ok)
+    
+    async def _restore_rules(self, op: str, ips: List[str]) -> bool:
+        """Одна транзакция iptables-restore --noflush с правилами INPUT DROP"""
+        # В ruleset попадают только адреса, прошедшие _parse_ipv4 в _queue_rule
+        ruleset = "*filter\n" + "".join(
+            f"{op} INPUT -s {ip} -j DROP\n" for ip in ips
+        ) + "COMMIT\n"
+        
+        try:
+            returncode, _, stderr = await self._run_command(
+                ["sudo", "iptables-restore", "--noflush"],
+                timeout=10,
+                stdin_data=ruleset.encode()
+            )
+            if returncode != 0:
+                logger.error(f"iptables-restore {op} failed for {len(ips)} rules: {stderr}")
+            return returncode == 0
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout applying {len(ips)} iptables rules")
+        except Exception as e:
+            logger.error(f"Error applying iptables rules: {e}")
+        return False
+    
+    async def _ipset_call(self, method: str, *args, **kwargs):
+        """Вызов метода IPSet в выделенном потоке, которому принадлежит netlink-сокет"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._ipset_executor, partial(getattr(self._ipset, method), *args, **kwargs)
+        )
+    
+    async def _ipset_available(self) -> bool:
+        """Подготовка ipset и ссылающегося на него правила iptables (один раз)"""
+        if self._ipset_ready is not None:
+            return self._ipset_ready
+        
+        async with self._ipset_lock:
+            if self._ipset_ready is None:
+                self._ipset_ready = await self._setup_ipset()
+        return self._ipset_ready
+    
+    async def _setup_ipset(self) -> bool:
+        """Создание ipset и правила DROP, ссылающегося на него"""
+        if IPSet is None:
+            return False
+        
+        loop = asyncio.get_running_loop()
+        self._ipset_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ipset")
+        try:
+            self._ipset = await loop.run_in_executor(self._ipset_executor, IPSet)
+            await self._ipset_call("create", self.BLOCK_SET, stype="hash:ip", exclusive=False)
+            
+            rule = ["INPUT", "-m", "set", "--match-set", self.BLOCK_SET, "src", "-j", "DROP"]
+            returncode, _, _ = await self._run_command(["sudo", "iptables", "-C", *rule], timeout=10)
+            if returncode != 0:
+                returncode, _, stderr = await self._run_command(["sudo", "iptables", "-I", *rule], timeout=10)
+                if returncode != 0:
+                    raise OSError(stderr)
+        except Exception as e:
+            logger.warning(f"ipset unavailable, falling back to iptables-restore: {e}")
+            if self._ipset is not None:
+                self._ipset.close()
+                self._ipset = None
+            self._ipset_executor.shutdown(wait=False)
+            self._ipset_executor = None
+            return False
+        
+        logger.info(f"Blocking IPs via ipset {self.BLOCK_SET}")
+        return True
+    
+    async def _apply_block(self, op: str, ip: str) -> bool:
+        """Добавление (-I) или снятие (-D) блокировки: через ipset, иначе пакетом iptables-restore"""
+        if not await self._ipset_available():
+            return await self._queue_rule(op, ip)
+        
+        try:
+            # Одно netlink-сообщение на адрес, поиск в хеше ядра вместо обхода цепочки
+            if op == "-I":
+                await self._ipset_call("add", self.BLOCK_SET, ip, exclusive=False)
+            else:
+                await self._ipset_call("delete", self.BLOCK_SET, ip, exclusive=False)
+            return True
+        except (NetlinkError, OSError, ValueError) as e:
+            logger.error(f"ipset {op} {ip} failed: {e}")
+            return False
+    
     async def _block_ip(self, ip: str, ttl_minutes: int):
         """Блокировка IP адреса"""
         if not ip:
             return
         
-        # Добавляем правило в iptables
-        cmd = [
-            "sudo", "iptables", "-I", "INPUT", "-s", ip, "-j", "DROP"
-        ]
+        # source_ip приходит из API: дальше идет только проверенная каноническая запись
+        address = _parse_ipv4(ip)
+        if address is None:
+            logger.error(f"Refusing to block invalid IPv4 address {ip!r}")
+            return
+        ip = address
         
-        try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-            if result.returncode == 0:
-                self.active_blocks[ip] = datetime.now() + timedelta(minutes=ttl_minutes)
-                logger.info(f"Blocked IP {ip} for {ttl_minutes} minutes")
-            else:
-                logger.error(f"Failed to block IP {ip}: {result.stderr}")
-        except subprocess.TimeoutExpired:
-            logger.error(f"Timeout blocking IP {ip}")
-        except Exception as e:
-            logger.error(f"Error blocking IP {ip}: {e}")
+        expiry = datetime.now() + timedelta(minutes=ttl_minutes)
+        current = self.active_blocks.get(ip)
+        if current is not None:
+            # Правило уже стоит: только продлеваем блокировку, без повторного вызова iptables/ipset
+            if expiry > current:
+                self.active_blocks[ip] = expiry
+                heapq.heappush(self._expiry_heap, (expiry.timestamp(), ip))
+            logger.info(f"IP {ip} already blocked until {self.active_blocks[ip].isoformat()}")
+            return
+        
+        # Адрес попадает в ipset или, без него, в пакет правил iptables
+        if await self._apply_block("-I", ip):
+            self.active_blocks[ip] = expiry
+            heapq.heappush(self._expiry_heap, (expiry.timestamp(), ip))
+            logger.info(f"Blocked IP {ip} for {ttl_minutes} minutes")
+        else:
+            logger.error(f"Failed to block IP {ip}")
+    
+    def is_blocked(self, ip: str) -> bool:
+        """Проверка, действует ли блокировка IP адреса"""
+        expiry = self.active_blocks.get(ip)
+        return expiry is not None and expiry > datetime.now()
     
     async def _apply_rate_limit(self, context: AlertContext, parameters: Dict):
         """Применение ограничений скорости"""
@@ -420,11 +814,11 @@ class AlertActionEngine:
         
         cmd = ["sudo", "systemctl", "restart", service]
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            if result.returncode == 0:
+            returncode, _, stderr = await self._run_command(cmd, timeout=30)
+            if returncode == 0:
                 logger.info(f"Restarted service {service}")
             else:
-                logger.error(f"Failed to restart service {service}: {result.stderr}")
+                logger.error(f"Failed to restart service {service}: {stderr}")
         except Exception as e:
             logger.error(f"Error restarting service {service}: {e}")
     
@@ -439,31 +833,61 @@ class AlertActionEngine:
             return
         
         try:
-            result = subprocess.run(cmd, capture_output=True, text=True, timeout=30)
-            if result.returncode == 0:
+            returncode, _, stderr = await self._run_command(cmd, timeout=30)
+            if returncode == 0:
                 logger.info(f"Flushed {cache_type} cache")
             else:
-                logger.error(f"Failed to flush {cache_type} cache: {result.stderr}")
+                logger.error(f"Failed to flush {cache_type} cache: {stderr}")
         except Exception as e:
             logger.error(f"Error flushing {cache_type} cache: {e}")
     
     async def _notify_admin(self, context: AlertContext):
         """Уведомление администратора"""
+        # Уведомление не отправляется сразу, а попадает в сводку фоновой задачи
+        self._notify_queue.put_nowait(context)
+        if self._notify_task is None or self._notify_task.done():
+            self._notify_task = asyncio.get_running_loop().create_task(self._notifier_loop())
+    
+    async def _notifier_loop(self):
+        """Отправка сводок уведомлений, пока в очереди есть алерты"""
+        while not self._notify_queue.empty():
+            await asyncio.sleep(self.NOTIFY_FLUSH_INTERVAL)
+            self._flush_notifications()
+    
+    def _flush_notifications(self):
+        """Отправка сводки по всем алертам, накопленным в очереди"""
+        queue = self._notify_queue
+        groups = Counter()
+        while not queue.empty():
+            context = queue.get_nowait()
+            groups[(context.alert_type, context.source_ip)] += 1
+        
         # Здесь можно интегрироваться с Slack, Telegram, email и т.д.
-        logger.warning(f"SECURITY ALERT: {context.alert_type.value} from {context.source_ip}")
+        for (alert_type, source_ip), count in groups.items():
+            if count == 1:
+                logger.warning(f"SECURITY ALERT: {_ALERT_TYPE_VALUES[alert_type]} from {source_ip}")
+            else:
+                logger.warning(
+                    f"SECURITY ALERT: {count} x {_ALERT_TYPE_VALUES[alert_type]} from {source_ip} "
+                    f"in last {self.NOTIFY_FLUSH_INTERVAL:g}s"
+                )
     
     async def _log_event(self, context: AlertContext):
         """Логирование события"""
+        # Событие не собирается и не сериализуется, если INFO отключен
+        if not logger.isEnabledFor(logging.INFO):
+            return
+        
         event_data = {
             "timestamp": context.timestamp.isoformat(),
-            "alert_type": context.alert_type.value,
+            "alert_type": _ALERT_TYPE_VALUES[context.alert_type],
             "source_ip": context.source_ip,
             "target_ip": context.target_ip,
-            "severity": context.severity.value,
+            "severity": _SEVERITY_VALUES[context.severity],
             "confidence": context.confidence,
             "additional_data": context.additional_data
         }
-        logger.info(f"Security event logged: {json.dumps(event_data)}")
+        logger.info("Security event logged: %s", _dumps(event_data))
     
     async def _run_custom_script(self, parameters: Dict, context: AlertContext):
         """Выполнение пользовательского скрипта"""
@@ -471,34 +895,35 @@ class AlertActionEngine:
         if not script_path:
             return
         
-        # Передаем контекст в скрипт через переменные окружения
-        env = {
-            "ALERT_TYPE": context.alert_type.value,
-            "SOURCE_IP": context.source_ip or "",
-            "TARGET_IP": context.target_ip or "",
-            "SEVERITY": context.severity.value,
-            "CONFIDENCE": str(context.confidence)
-        }
+        # Передаем контекст в скрипт через переменные окружения поверх окружения сервиса
+        env = self._script_env_base.copy()
+        env.update(
+            ALERT_TYPE=_ALERT_TYPE_VALUES[context.alert_type],
+            SOURCE_IP=context.source_ip or "",
+            TARGET_IP=context.target_ip or "",
+            SEVERITY=_SEVERITY_VALUES[context.severity],
+            CONFIDENCE=format(context.confidence, ".3f")
+        )
         
         try:
-            result = subprocess.run(
-                [script_path], 
-                capture_output=True, 
-                text=True, 
-                timeout=60,
-                env=env
+            # stdout скрипта читается только по запросу (parameters["capture_stdout"])
+            capture_stdout = bool(parameters.get("capture_stdout", False))
+            returncode, stdout, stderr = await self._run_command(
+                [script_path], timeout=60, env=env, capture_stdout=capture_stdout
             )
-            if result.returncode == 0:
+            if returncode == 0:
                 logger.info(f"Custom script {script_path} executed successfully")
+                if stdout:
+                    logger.info(f"Custom script {script_path} output: {stdout.rstrip()}")
             else:
-                logger.error(f"Custom script {script_path} failed: {result.stderr}")
+                logger.error(f"Custom script {script_path} failed: {stderr}")
         except Exception as e:
             logger.error(f"Error running custom script {script_path}: {e}")
     
     async def _queue_for_approval(self, config: ActionConfig, context: AlertContext):
         """Добавление действия в очередь для ручного подтверждения"""
         # Здесь можно интегрироваться с системой уведомлений
-        logger.info(f"Action {config.action_type.value} queued for approval")
+        logger.info(f"Action {_ACTION_TYPE_VALUES[config.action_type]} queued for approval")
     
     def get_pending_actions(self) -> List[Dict]:
         """Получение списка действий, ожидающих подтверждения"""
@@ -515,25 +940,139 @@ class AlertActionEngine:
     
     def get_action_history(self, limit: int = 100) -> List[Dict]:
         """Получение истории выполненных действий"""
-        return self.action_history[-limit:]
+        history = self.action_history
+        if 0 < limit < len(history):
+            # Хвост читается с конца deque без копирования всей истории
+            return list(islice(reversed(history), limit))[::-1]
+        return list(history)[-limit:]
+    
+    async def _unblock_ip(self, ip: str):
+        """Снятие блокировки IP адреса"""
+        # Удаляем адрес из ipset или правило из iptables (пакетом вместе с остальными)
+        if not await self._apply_block("-D", ip):
+            # Адрес все еще заблокирован: запись остается, снятие повторит следующая очистка
+            retry_at = datetime.now() + timedelta(seconds=self.UNBLOCK_RETRY_SEC)
+            self.active_blocks[ip] = retry_at
+            heapq.heappush(self._expiry_heap, (retry_at.timestamp(), ip))
+            logger.error(f"Error unblocking IP {ip}, retrying after {self.UNBLOCK_RETRY_SEC}s")
+            return
+        self.active_blocks.pop(ip, None)
+        logger.info(f"Unblocked IP {ip}")
     
-    def cleanup_expired_blocks(self):
+    async def cleanup_expired_blocks(self):
         """Очистка истекших блокировок"""
-        now = datetime.now()
-        expired_ips = [
-            ip for ip, expiry in self.active_blocks.items() 
-            if expiry <= now
-        ]
+        # Из кучи извлекаются только истекшие записи, без обхода всех блокировок
+        now_ts = datetime.now().timestamp()
+        heap = self._expiry_heap
+        expired_ips = []
+        while heap and heap[0][0] <= now_ts:
+            ts, ip = heapq.heappop(heap)
+            expiry = self.active_blocks.get(ip)
+            # Запись устарела, если IP уже разблокирован или блокировка продлена
+            if expiry is not None and expiry.timestamp() == ts:
+                expired_ips.append(ip)
         
-        for ip in expired_ips:
+        # Все удаления попадают в один вызов iptables-restore
+        await asyncio.gather(*(self._unblock_ip(ip) for ip in expired_ips))
+    
+    async def close(self):
+        """Остановка фоновых задач: накопленные уведомления и правила применяются сразу"""
+        notify_task, self._notify_task = self._notify_task, None
+        if notify_task is not None and not notify_task.done():
+            # Задача ждет окна агрегации; очередь при отмене не теряется
+            notify_task.cancel()
             try:
-                # Удаляем правило из iptables
-                cmd = ["sudo", "iptables", "-D", "INPUT", "-s", ip, "-j", "DROP"]
-                subprocess.run(cmd, capture_output=True, text=True, timeout=10)
-                del self.active_blocks[ip]
-                logger.info(f"Unblocked IP {ip}")
-            except Exception as e:
-                logger.error(f"Error unblocking IP {ip}: {e}")
+                await notify_task
+            except asyncio.CancelledError:
+                pass
+        self._flush_notifications()
+        
+        rules_task, self._rules_task = self._rules_task, None
+        if rules_task is not None and not rules_task.done():
+            # Пакет правил применяется без ожидания окна RULE_BATCH_WINDOW
+            self._rules_full.set()
+            await rules_task
+        
+        if self._ipset is not None:
+            await self._ipset_call("close")
+            self._ipset = None
+        if self._ipset_executor is not None:
+            self._ipset_executor.shutdown(wait=False)
+            self._ipset_executor = None
+        self._ipset_ready = None
+    
+    def __getstate__(self):
+        # В другой процесс передаются только конфигурация и блокировки;
+        # задачи, очереди, сокеты и скомпилированные конвейеры создаются заново
+        return {
+            "action_configs": dict(self.action_configs),
+            "active_blocks": dict(self.active_blocks),
+        }
+    
+    def __setstate__(self, state):
+        self.__init__()
+        self.action_configs.update(state["action_configs"])
+        self.active_blocks.update(state["active_blocks"])
+        self._expiry_heap = [(expiry.timestamp(), ip) for ip, expiry in self.active_blocks.items()]
+        heapq.heapify(self._expiry_heap)
+        self._compile_pipelines()
+
+
+def _parse_ipv4(ip: Optional[str]) -> Optional[str]:
+    """Каноническая запись IPv4-адреса или None, если строка адресом не является.
+    
+    Адрес попадает в текст для iptables-restore, выполняемый через sudo, поэтому
+    туда подставляется только str() разобранного адреса. IPv6 отклоняется: iptables
+    его не примет, и ошибка откатила бы весь пакет правил.
+    """
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if address.version != 4:
+        return None
+    return str(address)
+
+
+def shard_for(source_ip: Optional[str], shards: int) -> int:
+    """Номер шарда для IP источника.
+    
+    Используется crc32, а не hash(): хеш строк рандомизирован в каждом процессе,
+    а маршрутизация между рабочими процессами должна быть одинаковой.
+    """
+    return zlib.crc32((source_ip or "").encode()) % shards
+
+
+class AlertActionEngineShard:
+    """Набор движков, между которыми алерты распределяются по IP источника.
+    
+    Все алерты одного IP попадают в один движок, поэтому дедупликация, сводки
+    уведомлений и сроки блокировок шарда согласованы. Для работы в нескольких
+    процессах движки передаются рабочим процессам (они поддерживают pickle), а
+    входящие алерты маршрутизируются той же функцией shard_for. Общим источником
+    правды о блокировках служит ipset в ядре: повторное добавление адреса идемпотентно.
+    """
+    
+    def __init__(self, shards: int = 1):
+        if shards < 1:
+            raise ValueError("shards must be >= 1")
+        self.engines: List[AlertActionEngine] = [AlertActionEngine() for _ in range(shards)]
+    
+    def engine_for(self, source_ip: Optional[str]) -> AlertActionEngine:
+        """Движок, отвечающий за IP источника"""
+        return self.engines[shard_for(source_ip, len(self.engines))]
+    
+    async def process_alert(self, context: AlertContext) -> List[Dict]:
+        """Обработка алерта движком своего шарда"""
+        return await self.engine_for(context.source_ip).process_alert(context)
+    
+    async def cleanup_expired_blocks(self):
+        """Очистка истекших блокировок во всех шардах"""
+        await asyncio.gather(*(engine.cleanup_expired_blocks() for engine in self.engines))
+    
+    async def close(self):
+        """Остановка фоновых задач всех шардов"""
+        await asyncio.gather(*(engine.close() for engine in self.engines))
 
 # Глобальный экземпляр движка действий
 alert_action_engine = AlertActionEngine()
@@ -10,20 +10,48 @@ Alert Manager - Менеджер алертов для SIEM системы
 """
 
 from __future__ import annotations
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
 from dataclasses import dataclass, field
 from datetime import datetime, timezone, timedelta
 from enum import Enum
-from typing import Any, Dict, List, Optional, Union
+from functools import wraps
+from typing import Any, Dict, List, Optional, Tuple, Union
 import asyncio
 import json
 import logging
-import hashlib
+import threading
+import time
 from pathlib import Path
 
+# --- orjson (необязательно): экспорт алертов в JSON без чисто-питонового энкодера ---
 try:
-    import yaml
+    import orjson
+    
+    def _dumps_alerts(alerts) -> str:
+        # Датаклассы, enum и datetime orjson обходит сам — без промежуточного to_dict();
+        # порядок полей и формат дат совпадают с to_dict(), не-ASCII не экранируется
+        return orjson.dumps(list(alerts), option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS).decode()
+except ImportError:
+    def _dumps_alerts(alerts) -> str:
+        return json.dumps([alert.to_dict() for alert in alerts], indent=2, ensure_ascii=False)
+
+# Ключ дедупликации нужен только для словаря, криптостойкость не требуется:
+# xxh3 (если установлен xxhash) или встроенный hash() вместо MD5 + hexdigest
+try:
+    import xxhash
 except ImportError:
-    yaml = None
+    xxhash = None
+
+if xxhash is not None:
+    def _dedup_hash(parts: tuple) -> int:
+        # Одно C-форматирование вместо str() каждой части и "|".join
+        return xxhash.xxh3_64_intdigest(("%s\x00" * len(parts)) % parts)
+else:
+    def _dedup_hash(parts: tuple) -> int:
+        # siphash13 в C прямо по кортежу, без промежуточной строки;
+        # значение стабильно в пределах процесса, чего достаточно для индекса
+        return hash(parts)
 
 
 class AlertStatus(str, Enum):
@@ -55,7 +83,20 @@ class AlertType(str, Enum):
     COMPLIANCE = "compliance"      # Соответствие
 
 
-@dataclass
+# Допустимые исходные статусы переходов — готовые множества вместо списка на каждый вызов
+_CAN_START_PROGRESS = frozenset({AlertStatus.NEW, AlertStatus.ACKNOWLEDGED})
+_CAN_RESOLVE = frozenset({AlertStatus.IN_PROGRESS, AlertStatus.ACKNOWLEDGED})
+_CAN_CLOSE = frozenset({AlertStatus.RESOLVED, AlertStatus.ACKNOWLEDGED})
+_FINAL_STATUSES = frozenset({AlertStatus.RESOLVED, AlertStatus.CLOSED})
+_URGENT_SEVERITIES = frozenset({AlertSeverity.HIGH, AlertSeverity.CRITICAL})
+
+# Строковые значения enum: поиск в dict дешевле, чем дескриптор .value на каждом алерте
+_STATUS_VALUES = {member: member.value for member in AlertStatus}
+_SEVERITY_VALUES = {member: member.value for member in AlertSeverity}
+_ALERT_TYPE_VALUES = {member: member.value for member in AlertType}
+
+
+@dataclass(slots=True)
 class AlertContext:
     """Контекст алерта"""
     source_ip: Optional[str] = None
@@ -71,7 +112,7 @@ class AlertContext:
     additional_data: Dict[str, Any] = field(default_factory=dict)
 
 
-@dataclass
+@dataclass(slots=True)
 class Alert:
     """Алерт безопасности"""
     # Основные параметры
@@ -102,6 +143,8 @@ class Alert:
     acknowledged_at: Optional[datetime] = None
     resolved_at: Optional[datetime] = None
     closed_at: Optional[datetime] = None
+    # created_at в секундах epoch — для сравнений возраста без datetime/timedelta
+    _created_ts: float = field(init=False, repr=False, compare=False, default=0.0)
     
     # Жизненный цикл
     acknowledged_by: Optional[str] = None
@@ -110,7 +153,7 @@ class Alert:
     notes: List[str] = field(default_factory=list)
     
     # Дублирование и группировка
-    dedup_key: Optional[str] = None
+    dedup_key: Optional[Union[int, str]] = None  # 64-битный хеш; явно заданный ключ может быть строкой
     group_id: Optional[str] = None
     related_alerts: List[int] = field(default_factory=list)
     
@@ -122,28 +165,27 @@ class Alert:
     def __post_init__(self):
         if self.updated_at is None:
             self.updated_at = self.created_at
+        self._created_ts = self.created_at.timestamp()
         
         # Генерируем dedup_key если не задан
         if not self.dedup_key:
             self.dedup_key = self._generate_dedup_key()
     
-    def _generate_dedup_key(self) -> str:
+    def _generate_dedup_key(self) -> int:
         """Генерирует ключ для дедупликации"""
-        key_parts = [
+        context = self.context
+        return _dedup_hash((
             self.source,
-            self.rule_name or "",
-            str(self.context.source_ip or ""),
-            str(self.context.destination_ip or ""),
-            str(self.context.source_port or ""),
-            str(self.context.destination_port or ""),
-            str(self.context.protocol or ""),
-            str(self.context.user or ""),
-            str(self.alert_type.value),
-            str(self.severity.value)
-        ]
-        
-        key_string = "|".join(key_parts)
-        return hashlib.md5(key_string.encode()).hexdigest()
+            self.rule_name,
+            context.source_ip,
+            context.destination_ip,
+            context.source_port,
+            context.destination_port,
+            context.protocol,
+            context.user,
+            _ALERT_TYPE_VALUES[self.alert_type],
+            _SEVERITY_VALUES[self.severity]
+        ))
     
     def to_dict(self) -> Dict[str, Any]:
         """Преобразует алерт в словарь"""
@@ -151,9 +193,9 @@ class Alert:
             'id': self.id,
             'title': self.title,
             'description': self.description,
-            'alert_type': self.alert_type.value,
-            'severity': self.severity.value,
-            'status': self.status.value,
+            'alert_type': _ALERT_TYPE_VALUES[self.alert_type],
+            'severity': _SEVERITY_VALUES[self.severity],
+            'status': _STATUS_VALUES[self.status],
             'source': self.source,
             'rule_name': self.rule_name,
             'event_id': self.event_id,
@@ -219,50 +261,54 @@ class Alert:
         if self.status != AlertStatus.NEW:
             raise ValueError(f"Cannot acknowledge alert in status {self.status}")
         
+        now = datetime.now(timezone.utc)
         self.status = AlertStatus.ACKNOWLEDGED
-        self.acknowledged_at = datetime.now(timezone.utc)
+        self.acknowledged_at = now
         self.acknowledged_by = user
-        self.updated_at = datetime.now(timezone.utc)
+        self.updated_at = now
         
         if note:
-            self.notes.append(f"[{datetime.now(timezone.utc).isoformat()}] {user}: {note}")
+            self.notes.append(f"[{now.isoformat()}] {user}: {note}")
     
     def start_progress(self, user: str, note: str = None):
         """Начинает работу над алертом"""
-        if self.status not in [AlertStatus.NEW, AlertStatus.ACKNOWLEDGED]:
+        if self.status not in _CAN_START_PROGRESS:
             raise ValueError(f"Cannot start progress on alert in status {self.status}")
         
+        now = datetime.now(timezone.utc)
         self.status = AlertStatus.IN_PROGRESS
-        self.updated_at = datetime.now(timezone.utc)
+        self.updated_at = now
         
         if note:
-            self.notes.append(f"[{datetime.now(timezone.utc).isoformat()}] {user}: {note}")
+            self.notes.append(f"[{now.isoformat()}] {user}: {note}")
     
     def resolve(self, user: str, note: str = None):
         """Решает алерт"""
-        if self.status not in [AlertStatus.IN_PROGRESS, AlertStatus.ACKNOWLEDGED]:
+        if self.status not in _CAN_RESOLVE:
             raise ValueError(f"Cannot resolve alert in status {self.status}")
         
+        now = datetime.now(timezone.utc)
         self.status = AlertStatus.RESOLVED
-        self.resolved_at = datetime.now(timezone.utc)
+        self.resolved_at = now
         self.resolved_by = user
-        self.updated_at = datetime.now(timezone.utc)
+        self.updated_at = now
         
         if note:
-            self.notes.append(f"[{datetime.now(timezone.utc).isoformat()}] {user}: {note}")
+            self.notes.append(f"[{now.isoformat()}] {user}: {note}")
     
     def close(self, user: str, note: str = None):
         """Закрывает алерт"""
-        if self.status not in [AlertStatus.RESOLVED, AlertStatus.ACKNOWLEDGED]:
+        if self.status not in _CAN_CLOSE:
             raise ValueError(f"Cannot close alert in status {self.status}")
         
+        now = datetime.now(timezone.utc)
         self.status = AlertStatus.CLOSED
-        self.closed_at = datetime.now(timezone.utc)
+        self.closed_at = now
         self.closed_by = user
-        self.updated_at = datetime.now(timezone.utc)
+        self.updated_at = now
         
         if note:
-            self.notes.append(f"[{datetime.now(timezone.utc).isoformat()}] {user}: {note}")
+            self.notes.append(f"[{now.isoformat()}] {user}: {note}")
     
     def escalate(self, escalation_rule: str, note: str = None):
         """Эскалирует алерт"""
@@ -270,18 +316,19 @@ class Alert:
             raise ValueError(f"Alert already at maximum escalation level {self.max_escalation_level}")
         
         self.escalation_level += 1
+        now = datetime.now(timezone.utc)
         self.status = AlertStatus.ESCALATED
-        self.updated_at = datetime.now(timezone.utc)
+        self.updated_at = now
         self.escalation_rules.append(escalation_rule)
         
         if note:
-            self.notes.append(f"[{datetime.now(timezone.utc).isoformat()}] ESCALATED: {note}")
+            self.notes.append(f"[{now.isoformat()}] ESCALATED: {note}")
     
     def add_note(self, user: str, note: str):
         """Добавляет заметку к алерту"""
-        timestamp = datetime.now(timezone.utc).isoformat()
-        self.notes.append(f"[{timestamp}] {user}: {note}")
-        self.updated_at = datetime.now(timezone.utc)
+        now = datetime.now(timezone.utc)
+        self.notes.append(f"[{now.isoformat()}] {user}: {note}")
+        self.updated_at = now
     
     def is_duplicate_of(self, other: 'Alert') -> bool:
         """Проверяет, является ли алерт дубликатом другого"""
@@ -294,32 +341,41 @@ class Alert:
             self.alert_type == other.alert_type and
             self.severity == other.severity and
             self.context.source_ip == other.context.source_ip and
-            abs((self.created_at - other.created_at).total_seconds()) < 3600  # 1 час
+            abs(self._created_ts - other._created_ts) < 3600  # 1 час
         )
     
     def get_age(self) -> timedelta:
         """Возвращает возраст алерта"""
         return datetime.now(timezone.utc) - self.created_at
     
+    def get_age_seconds(self, now: Optional[float] = None) -> float:
+        """Возвращает возраст алерта в секундах (now — time.time(), если уже известен)"""
+        if now is None:
+            now = time.time()
+        return now - self._created_ts
+    
     def is_stale(self, max_age_hours: int = 24) -> bool:
         """Проверяет, устарел ли алерт"""
-        return self.get_age().total_seconds() > max_age_hours * 3600
+        return self.get_age_seconds() > max_age_hours * 3600
     
     def requires_escalation(self) -> bool:
         """Проверяет, требует ли алерт эскалации"""
-        if self.status in [AlertStatus.RESOLVED, AlertStatus.CLOSED]:
+        if self.status in _FINAL_STATUSES:
             return False
         
+        # Возраст считаем один раз для всех порогов
+        age_seconds = self.get_age_seconds()
+        
         # Эскалация по времени
-        if self.status == AlertStatus.NEW and self.get_age().total_seconds() > 3600:  # 1 час
+        if self.status == AlertStatus.NEW and age_seconds > 3600:  # 1 час
             return True
         
-        if self.status == AlertStatus.ACKNOWLEDGED and self.get_age().total_seconds() > 7200:  # 2 часа
+        if self.status == AlertStatus.ACKNOWLEDGED and age_seconds > 7200:  # 2 часа
             return True
         
         # Эскалация по важности
-        if self.severity in [AlertSeverity.HIGH, AlertSeverity.CRITICAL]:
-            if self.status == AlertStatus.NEW and self.get_age().total_seconds() > 1800:  # 30 минут
+        if self.severity in _URGENT_SEVERITIES:
+            if self.status == AlertStatus.NEW and age_seconds > 1800:  # 30 минут
                 return True
         
         return False
@@ -363,9 +419,9 @@ class AlertLifecycle:
             return "immediate_escalation"
         elif alert.severity == AlertSeverity.HIGH:
             return "high_priority_escalation"
-        elif alert.status == AlertStatus.NEW and alert.get_age().total_seconds() > 3600:
+        elif alert.status == AlertStatus.NEW and alert.get_age_seconds() > 3600:
             return "time_based_escalation"
-        elif alert.status == AlertStatus.ACKNOWLEDGED and alert.get_age().total_seconds() > 7200:
+        elif alert.status == AlertStatus.ACKNOWLEDGED and alert.get_age_seconds() > 7200:
             return "acknowledgment_timeout_escalation"
         
         return None
@@ -384,6 +440,15 @@ class AlertLifecycle:
         self.logger.info(f"Alert {alert.id} escalated with action: {escalation_action}")
 
 
+def _synchronized(method):
+    """Выполняет метод AlertManager под его блокировкой"""
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self._lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class AlertManager:
     """Основной менеджер алертов"""
     
@@ -391,10 +456,27 @@ class AlertManager:
         self.logger = logging.getLogger("alert_manager")
         self.config = config or {}
         self.alerts: Dict[int, Alert] = {}
-        self.alerts_by_dedup: Dict[str, Alert] = {}
-        self.alerts_by_group: Dict[str, List[Alert]] = {}
+        self.alerts_by_dedup: Dict[Union[int, str], Alert] = {}
+        # Группа: {id: алерт} — удаление за O(1), первый алерт группы остаётся первым ключом
+        self.alerts_by_group: Dict[str, Dict[int, Alert]] = {}
+        
+        # Вторичные индексы: значение поля -> {id: алерт}
+        # (dict как упорядоченное множество — порядок выдачи совпадает с порядком добавления)
+        self._by_status: Dict[AlertStatus, Dict[int, Alert]] = defaultdict(dict)
+        self._by_severity: Dict[AlertSeverity, Dict[int, Alert]] = defaultdict(dict)
+        self._by_type: Dict[AlertType, Dict[int, Alert]] = defaultdict(dict)
+        self._by_source: Dict[str, Dict[int, Alert]] = defaultdict(dict)
+        # Отсортированный по времени создания список (created_ts, id) для выборок по диапазону
+        self._by_time: List[Tuple[float, int]] = []
+        
+        # Индекс групп: (тип, важность, source_ip, час) -> {group_id: (номер группы, первый алерт)}
+        self._group_index: Dict[Tuple, Dict[str, Tuple[int, Alert]]] = defaultdict(dict)
         self.lifecycle = AlertLifecycle()
         
+        # Методы синхронные, поэтому внутри event loop они и так атомарны; блокировка
+        # защищает индексы и счетчики при вызовах из потоков (RLock — методы вызывают друг друга)
+        self._lock = threading.RLock()
+        
         # Статистика
         self.stats = {
             'total_created': 0,
@@ -409,6 +491,7 @@ class AlertManager:
         # Счетчик для генерации ID
         self._next_id = 1
     
+    @_synchronized
     def create_alert(
         self,
         title: str,
@@ -451,6 +534,7 @@ class AlertManager:
         self.alerts[alert.id] = alert
         if alert.dedup_key:
             self.alerts_by_dedup[alert.dedup_key] = alert
+        self._index_alert(alert)
         
         # Группируем алерты
         self._try_group_alert(alert)
@@ -462,35 +546,100 @@ class AlertManager:
         self.logger.info(f"Created alert {alert.id}: {title}")
         return alert
     
-    def _generate_dedup_key(self, title: str, source: str, rule_name: Optional[str], context: AlertContext) -> str:
+    def _generate_dedup_key(self, title: str, source: str, rule_name: Optional[str], context: AlertContext) -> int:
         """Генерирует ключ дедупликации"""
-        key_parts = [
+        return _dedup_hash((
             source,
-            rule_name or "",
-            str(context.source_ip or ""),
-            str(context.destination_ip or ""),
-            str(context.source_port or ""),
-            str(context.destination_port or ""),
-            str(context.protocol or ""),
-            str(context.user or ""),
+            rule_name,
+            context.source_ip,
+            context.destination_ip,
+            context.source_port,
+            context.destination_port,
+            context.protocol,
+            context.user,
             title
-        ]
-        
-        key_string = "|".join(key_parts)
-        return hashlib.md5(key_string.encode()).hexdigest()
+        ))
+    
+    def _index_alert(self, alert: Alert):
+        """Добавляет алерт во вторичные индексы"""
+        self._by_status[alert.status][alert.id] = alert
+        self._by_severity[alert.severity][alert.id] = alert
+        self._by_type[alert.alert_type][alert.id] = alert
+        self._by_source[alert.source][alert.id] = alert
+        entry = (alert._created_ts, alert.id)
+        if not self._by_time or self._by_time[-1] <= entry:
+            # Обычный случай — алерты приходят по возрастанию времени
+            self._by_time.append(entry)
+        else:
+            insort(self._by_time, entry)
+    
+    def _unindex_alert(self, alert: Alert):
+        """Удаляет алерт из вторичных индексов"""
+        for index, key in (
+            (self._by_status, alert.status),
+            (self._by_severity, alert.severity),
+            (self._by_type, alert.alert_type),
+            (self._by_source, alert.source),
+        ):
+            bucket = index.get(key)
+            if bucket is not None:
+                bucket.pop(alert.id, None)
+                if not bucket:
+                    del index[key]
+        entry = (alert._created_ts, alert.id)
+        position = bisect_left(self._by_time, entry)
+        if position < len(self._by_time) and self._by_time[position] == entry:
+            del self._by_time[position]
+    
+    def _reindex_status(self, alert: Alert, old_status: AlertStatus):
+        """Переносит алерт в индексе статусов после перехода"""
+        if alert.status == old_status:
+            return
+        bucket = self._by_status.get(old_status)
+        if bucket is not None:
+            bucket.pop(alert.id, None)
+            if not bucket:
+                del self._by_status[old_status]
+        self._by_status[alert.status][alert.id] = alert
+    
+    @staticmethod
+    def _group_signature(alert: Alert) -> Tuple:
+        """Сигнатура группы: поля can_group_with плюс часовое окно created_at"""
+        return (
+            alert.alert_type,
+            alert.severity,
+            alert.context.source_ip,
+            int(alert._created_ts // 3600)
+        )
     
     def _try_group_alert(self, alert: Alert):
         """Пытается сгруппировать алерт с существующими"""
-        for group_id, group_alerts in self.alerts_by_group.items():
-            if group_alerts and alert.can_group_with(group_alerts[0]):
-                group_alerts.append(alert)
-                alert.group_id = group_id
-                self.logger.info(f"Alert {alert.id} added to group {group_id}")
-                return
-        
-        # Создаем новую группу
-        group_id = f"group_{len(self.alerts_by_group) + 1}"
-        self.alerts_by_group[group_id] = [alert]
+        # Окно can_group_with — ±1 час, поэтому достаточно соседних часовых корзин;
+        # из подходящих берём самую раннюю группу, как при полном переборе
+        # Сигнатура считается один раз; соседние корзины отличаются только часом
+        signature = self._group_signature(alert)
+        alert_type, severity, source_ip, hour = signature
+        found = None
+        for key in ((alert_type, severity, source_ip, hour - 1), signature, (alert_type, severity, source_ip, hour + 1)):
+            bucket = self._group_index.get(key)
+            if not bucket:
+                continue
+            for group_id, (group_seq, first_alert) in bucket.items():
+                if (found is None or group_seq < found[0]) and alert.can_group_with(first_alert):
+                    found = (group_seq, group_id)
+        
+        if found is not None:
+            group_id = found[1]
+            self.alerts_by_group[group_id][alert.id] = alert
+            alert.group_id = group_id
+            self.logger.info(f"Alert {alert.id} added to group {group_id}")
+            return
+        
+        # Создаем новую группу (номер из счетчика, чтобы не повторять id после удаления групп)
+        group_seq = self.stats['groups_created'] + 1
+        group_id = f"group_{group_seq}"
+        self.alerts_by_group[group_id] = {alert.id: alert}
+        self._group_index[signature][group_id] = (group_seq, alert)
         alert.group_id = group_id
         self.stats['groups_created'] += 1
         
@@ -502,44 +651,50 @@ class AlertManager:
     
     def get_alerts_by_status(self, status: AlertStatus) -> List[Alert]:
         """Получает алерты по статусу"""
-        return [alert for alert in self.alerts.values() if alert.status == status]
+        return list(self._by_status.get(status, {}).values())
     
     def get_alerts_by_severity(self, severity: AlertSeverity) -> List[Alert]:
         """Получает алерты по важности"""
-        return [alert for alert in self.alerts.values() if alert.severity == severity]
+        return list(self._by_severity.get(severity, {}).values())
     
     def get_alerts_by_type(self, alert_type: AlertType) -> List[Alert]:
         """Получает алерты по типу"""
-        return [alert for alert in self.alerts.values() if alert.alert_type == alert_type]
+        return list(self._by_type.get(alert_type, {}).values())
     
     def get_alerts_by_source(self, source: str) -> List[Alert]:
         """Получает алерты по источнику"""
-        return [alert for alert in self.alerts.values() if alert.source == source]
+        return list(self._by_source.get(source, {}).values())
     
     def get_alerts_by_group(self, group_id: str) -> List[Alert]:
         """Получает алерты по группе"""
-        return self.alerts_by_group.get(group_id, [])
+        return list(self.alerts_by_group.get(group_id, {}).values())
     
+    @_synchronized
     def get_alerts_by_time_range(self, start_time: datetime, end_time: datetime) -> List[Alert]:
         """Получает алерты в временном диапазоне"""
-        return [
-            alert for alert in self.alerts.values()
-            if start_time <= alert.created_at <= end_time
-        ]
+        # Бинарный поиск границ: O(log N + K) вместо перебора всех алертов
+        by_time = self._by_time
+        lo = bisect_left(by_time, (start_time.timestamp(),))
+        hi = bisect_right(by_time, (end_time.timestamp(), float("inf")))
+        alerts = self.alerts
+        return [alerts[alert_id] for _, alert_id in by_time[lo:hi]]
     
     def get_recent_alerts(self, hours: int = 24) -> List[Alert]:
         """Получает недавние алерты"""
-        cutoff_time = datetime.now(timezone.utc) - timedelta(hours=hours)
-        return self.get_alerts_by_time_range(cutoff_time, datetime.now(timezone.utc))
+        now = datetime.now(timezone.utc)
+        return self.get_alerts_by_time_range(now - timedelta(hours=hours), now)
     
+    @_synchronized
     def acknowledge_alert(self, alert_id: int, user: str, note: str = None) -> bool:
         """Подтверждает алерт"""
         alert = self.get_alert(alert_id)
         if not alert:
             return False
         
+        old_status = alert.status
         try:
             alert.acknowledge(user, note)
+            self._reindex_status(alert, old_status)
             self.stats['total_acknowledged'] += 1
             self.logger.info(f"Alert {alert_id} acknowledged by {user}")
             return True
@@ -547,14 +702,17 @@ class AlertManager:
             self.logger.error(f"Failed to acknowledge alert {alert_id}: {e}")
             return False
     
+    @_synchronized
     def resolve_alert(self, alert_id: int, user: str, note: str = None) -> bool:
         """Решает алерт"""
         alert = self.get_alert(alert_id)
         if not alert:
             return False
         
+        old_status = alert.status
         try:
             alert.resolve(user, note)
+            self._reindex_status(alert, old_status)
             self.stats['total_resolved'] += 1
             self.logger.info(f"Alert {alert_id} resolved by {user}")
             return True
@@ -562,14 +720,17 @@ class AlertManager:
             self.logger.error(f"Failed to resolve alert {alert_id}: {e}")
             return False
     
+    @_synchronized
     def close_alert(self, alert_id: int, user: str, note: str = None) -> bool:
         """Закрывает алерт"""
         alert = self.get_alert(alert_id)
         if not alert:
             return False
         
+        old_status = alert.status
         try:
             alert.close(user, note)
+            self._reindex_status(alert, old_status)
             self.stats['total_closed'] += 1
             self.logger.info(f"Alert {alert_id} closed by {user}")
             return True
@@ -577,14 +738,17 @@ class AlertManager:
             self.logger.error(f"Failed to close alert {alert_id}: {e}")
             return False
     
+    @_synchronized
     def escalate_alert(self, alert_id: int, escalation_rule: str, note: str = None) -> bool:
         """Эскалирует алерт"""
         alert = self.get_alert(alert_id)
         if not alert:
             return False
         
+        old_status = alert.status
         try:
             alert.escalate(escalation_rule, note)
+            self._reindex_status(alert, old_status)
             self.stats['total_escalated'] += 1
             self.logger.info(f"Alert {alert_id} escalated with rule {escalation_rule}")
             return True
@@ -592,6 +756,7 @@ class AlertManager:
             self.logger.error(f"Failed to escalate alert {alert_id}: {e}")
             return False
     
+    @_synchronized
     def add_note_to_alert(self, alert_id: int, user: str, note: str) -> bool:
         """Добавляет заметку к алерту"""
         alert = self.get_alert(alert_id)
@@ -602,20 +767,34 @@ class AlertManager:
         self.logger.info(f"Note added to alert {alert_id} by {user}")
         return True
     
+    @_synchronized
     def check_escalations(self):
         """Проверяет и применяет эскалации"""
-        for alert in self.alerts.values():
+        # requires_escalation срабатывает только для NEW и ACKNOWLEDGED — остальные
+        # статусы не перебираем; список, т.к. эскалация переносит алерт между корзинами
+        candidates = [
+            alert
+            for status in (AlertStatus.NEW, AlertStatus.ACKNOWLEDGED)
+            for alert in self._by_status.get(status, {}).values()
+        ]
+        for alert in candidates:
             if self.lifecycle.should_escalate(alert):
                 escalation_action = self.lifecycle.get_escalation_action(alert)
                 if escalation_action:
+                    old_status = alert.status
                     self.lifecycle.apply_escalation(alert, escalation_action)
+                    self._reindex_status(alert, old_status)
     
+    @_synchronized
     def cleanup_stale_alerts(self, max_age_hours: int = 168):  # 1 неделя
         """Очищает устаревшие алерты"""
-        cutoff_time = datetime.now(timezone.utc) - timedelta(hours=max_age_hours)
+        cutoff_ts = time.time() - max_age_hours * 3600
+        # Кандидаты только из корзин RESOLVED/CLOSED индекса статусов
         stale_alerts = [
-            alert_id for alert_id, alert in self.alerts.items()
-            if alert.created_at < cutoff_time and alert.status in [AlertStatus.RESOLVED, AlertStatus.CLOSED]
+            alert_id
+            for status in (AlertStatus.RESOLVED, AlertStatus.CLOSED)
+            for alert_id, alert in self._by_status.get(status, {}).items()
+            if alert._created_ts < cutoff_ts
         ]
         
         for alert_id in stale_alerts:
@@ -636,44 +815,59 @@ class AlertManager:
         # Удаляем из индекса дедупликации
         if alert.dedup_key in self.alerts_by_dedup:
             del self.alerts_by_dedup[alert.dedup_key]
+        self._unindex_alert(alert)
         
         # Удаляем из группировки
         if alert.group_id:
-            group = self.alerts_by_group.get(alert.group_id, [])
-            group[:] = [a for a in group if a.id != alert_id]
+            group = self.alerts_by_group.get(alert.group_id, {})
+            was_first = next(iter(group), None) == alert_id
+            group.pop(alert_id, None)
+            if was_first:
+                # Группа сравнивается по первому алерту — переносим её в индексе
+                signature = self._group_signature(alert)
+                bucket = self._group_index.get(signature, {})
+                entry = bucket.pop(alert.group_id, None)
+                if not bucket:
+                    self._group_index.pop(signature, None)
+                if group and entry is not None:
+                    first_alert = next(iter(group.values()))
+                    self._group_index[self._group_signature(first_alert)][alert.group_id] = (entry[0], first_alert)
             if not group:
-                del self.alerts_by_group[alert.group_id]
+                self.alerts_by_group.pop(alert.group_id, None)
     
+    @_synchronized
     def get_stats(self) -> Dict[str, Any]:
         """Возвращает статистику менеджера алертов"""
         return {
             **self.stats,
             'total_alerts': len(self.alerts),
             'alerts_by_status': {
-                status.value: len(self.get_alerts_by_status(status))
-                for status in AlertStatus
+                value: len(self._by_status.get(status, ()))
+                for status, value in _STATUS_VALUES.items()
             },
             'alerts_by_severity': {
-                severity.value: len(self.get_alerts_by_severity(severity))
-                for severity in AlertSeverity
+                value: len(self._by_severity.get(severity, ()))
+                for severity, value in _SEVERITY_VALUES.items()
             },
             'alerts_by_type': {
-                alert_type.value: len(self.get_alerts_by_type(alert_type))
-                for alert_type in AlertType
+                value: len(self._by_type.get(alert_type, ()))
+                for alert_type, value in _ALERT_TYPE_VALUES.items()
             },
             'groups_count': len(self.alerts_by_group),
             'duplicates_prevented': self.stats['duplicates_prevented']
         }
     
+    @_synchronized
     def export_alerts(self, format: str = "json") -> str:
         """Экспортирует алерты в указанном формате"""
         if format.lower() == "json":
-            return json.dumps(
-                [alert.to_dict() for alert in self.alerts.values()],
-                indent=2,
-                ensure_ascii=False
-            )
-        elif format.lower() == "yaml" and yaml:
+            return _dumps_alerts(self.alerts.values())
+        elif format.lower() == "yaml":
+            # PyYAML нужен только этому экспорту — импорт при первом вызове, а не при загрузке модуля
+            try:
+                import yaml
+            except ImportError:
+                raise ValueError(f"Unsupported export format: {format} (PyYAML is not installed)") from None
             return yaml.dump(
                 [alert.to_dict() for alert in self.alerts.values()],
                 default_flow_style=False,
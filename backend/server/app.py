@@ -1,4 +1,5 @@
 import logging
+import zlib
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from .settings import settings
@@ -23,6 +24,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+class GzipRequestMiddleware:
+    """Распаковывает тела запросов с Content-Encoding: gzip (пакеты событий от агентов)"""
+
+    MAX_BODY = 32 * 1024 * 1024
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (b"content-encoding", b"gzip") not in scope["headers"]:
+            return await self.app(scope, receive, send)
+
+        chunks = []
+        received = 0
+        more_body = True
+        while more_body:
+            message = await receive()
+            chunk = message.get("body", b"")
+            # Сжатое тело тоже ограничено: читать дальше предела не имеет смысла
+            received += len(chunk)
+            if received > self.MAX_BODY:
+                return await self._reject(send, 413, b"Request body too large")
+            chunks.append(chunk)
+            more_body = message.get("more_body", False)
+        try:
+            # wbits=16+MAX_WBITS — формат gzip; max_length защищает от zip-бомб
+            inflater = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            body = inflater.decompress(b"".join(chunks), self.MAX_BODY)
+            too_large = bool(inflater.unconsumed_tail)
+        except zlib.error:
+            return await self._reject(send, 400, b"Invalid gzip body")
+        if too_large:
+            return await self._reject(send, 413, b"Request body too large")
+
+        headers = [(k, v) for k, v in scope["headers"]
+                   if k not in (b"content-encoding", b"content-length")]
+        headers.append((b"content-length", str(len(body)).encode()))
+        sent = False
+
+        async def receive_body():
+            nonlocal sent
+            if sent:
+                return await receive()
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+
+        await self.app(dict(scope, headers=headers), receive_body, send)
+
+    @staticmethod
+    async def _reject(send, status, detail):
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"text/plain")]})
+        await send({"type": "http.response.body", "body": detail})
+
+app.add_middleware(GzipRequestMiddleware)
+
 app.include_router(auth.router, prefix="/api/auth", tags=["auth"])
 app.include_router(events.router, prefix="/api/events", tags=["events"])
 app.include_router(alerts.router, prefix="/api/alerts", tags=["alerts"])
@@ -119,6 +176,14 @@ async def shutdown_event():
         log.error(f"Failed to import analyzer integration for shutdown: {e}")
     except Exception as e:
         log.error(f"Failed to shutdown analyzer integration: {e}")
+    
+    # Отправить накопленные уведомления и применить ожидающие правила блокировок
+    try:
+        from ..analyzer.engine.alert_actions import alert_action_engine
+        await alert_action_engine.close()
+        log.info("Alert action engine stopped")
+    except Exception as e:
+        log.error(f"Failed to stop alert action engine: {e}")
 
 @app.get("/")
 async def root():